@@ -0,0 +1,191 @@
+# Offline throughput benchmark for on_message. Replays synthetic traffic
+# through bot.py's handler with stand-in guilds, members, channels and
+# messages; sends are counted instead of going to Discord. The bot runs
+# against a scratch copy of the data directory, so nothing real is touched.
+#
+#   python benchmark.py --guilds 50 --users 200 --messages 50000
+#   python benchmark.py --data data --command-rate 0.05
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark on_message with synthetic traffic')
+    parser.add_argument('--guilds', type=int, default=20, help='number of guilds')
+    parser.add_argument('--users', type=int, default=100, help='members per guild')
+    parser.add_argument('--messages', type=int, default=20000, help='messages to replay')
+    parser.add_argument('--mention-rate', type=float, default=0.1, help='fraction of messages that mention another member')
+    parser.add_argument('--afk-ratio', type=float, default=0.05, help='fraction of members that start out AFK')
+    parser.add_argument('--command-rate', type=float, default=0.02, help='fraction of messages that are prefix commands')
+    # The replay runs far faster than real time, so the bot's own cooldown
+    # would turn away nearly every message before it reaches add_xp
+    parser.add_argument('--xp-cooldown', type=float, default=0, help='XP_COOLDOWN for the run (default 0 awards XP on every message)')
+    parser.add_argument('--warmup', type=int, default=1000, help='messages replayed before measuring')
+    parser.add_argument('--data', help='data directory to copy into the scratch directory')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+sends = Counter()
+
+
+class FakeUser:
+    def __init__(self, user_id, bot=False):
+        self.id = user_id
+        self.bot = bot
+        self.name = f'user{user_id}'
+        self.display_name = self.name
+        self.mention = f'<@{user_id}>'
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = f'guild{guild_id}'
+        self.members = {}
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+
+    async def send(self, content=None, **kwargs):
+        sends['channel'] += 1
+
+
+class FakeMessage:
+    # Context reads the connection state off the message; set in main()
+    _state = None
+
+    def __init__(self, guild, author, channel, content, mentions):
+        self.guild = guild
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.mentions = mentions
+        self.attachments = []
+
+
+async def fake_context_send(self, content=None, **kwargs):
+    sends['command'] += 1
+
+
+def make_traffic(args, prefix):
+    rng = random.Random(args.seed)
+    guilds = []
+    for g in range(args.guilds):
+        guild = FakeGuild(1000 + g)
+        channels = [FakeChannel(guild.id * 10 + c, guild) for c in range(3)]
+        for u in range(args.users):
+            member = FakeUser(10 ** 6 + g * args.users + u)
+            guild.members[member.id] = member
+        guilds.append((guild, channels, list(guild.members.values())))
+
+    commands = ['balance', 'rank']
+    messages = []
+    for _ in range(args.warmup + args.messages):
+        guild, channels, members = rng.choice(guilds)
+        author = rng.choice(members)
+        mentions = [rng.choice(members)] if rng.random() < args.mention_rate else []
+        if rng.random() < args.command_rate:
+            content = f'{prefix}{rng.choice(commands)}'
+        else:
+            content = 'hello there ' + ' '.join(m.mention for m in mentions)
+        messages.append(FakeMessage(guild, author, rng.choice(channels), content, mentions))
+    return rng, guilds, messages
+
+
+def total_xp(bot_module, guilds):
+    bot_module.commit_pending_xp()
+    return sum(bot_module.levels.total(guild.id, 'xp') for guild, _, _ in guilds)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(args, bot_module, rng, guilds, messages):
+    for guild, _, members in guilds:
+        for member in members:
+            if rng.random() < args.afk_ratio:
+                bot_module.set_afk(guild.id, member.id, 'benchmark')
+
+    bot_module.start_loop(bot_module.commit_xp)
+    if bot_module.WRITE_BEHIND:
+        bot_module.start_loop(bot_module.flush_data)
+
+    latencies = []
+    started = None
+    xp_before = 0
+    for i, message in enumerate(messages):
+        if i == args.warmup:
+            sends.clear()
+            xp_before = total_xp(bot_module, guilds)
+            started = time.perf_counter()
+        before = time.perf_counter_ns()
+        await bot_module.on_message(message)
+        if i >= args.warmup:
+            latencies.append(time.perf_counter_ns() - before)
+        # Let the background loops run, outside the measured time
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    bot_module.commit_xp.cancel()
+    bot_module.flush_data.cancel()
+    xp_awarded = total_xp(bot_module, guilds) - xp_before
+    bot_module.flush_dirty_stores_sync()
+    return latencies, elapsed, xp_awarded
+
+
+def main():
+    args = parse_args()
+    repo = os.path.dirname(os.path.abspath(__file__))
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix='bot-benchmark-')
+    if args.data:
+        shutil.copytree(args.data, os.path.join(scratch, 'data'))
+
+    # bot.py keeps its data relative to the working directory
+    os.chdir(scratch)
+    sys.path.insert(0, repo)
+    try:
+        import bot as bot_module
+        from discord.ext import commands
+
+        bot_module.load_data()
+        bot_module.XP_COOLDOWN = args.xp_cooldown
+        bot_module.bot._connection.user = FakeUser(1, bot=True)
+        FakeMessage._state = bot_module.bot._connection
+        commands.Context.send = fake_context_send
+
+        rng, guilds, messages = make_traffic(args, '?')
+        latencies, elapsed, xp_awarded = asyncio.run(run(args, bot_module, rng, guilds, messages))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    latencies.sort()
+    print(f'{len(latencies)} messages across {args.guilds} guilds x {args.users} members in {elapsed:.2f}s')
+    print(f'Throughput: {len(latencies) / elapsed:.0f} messages/sec')
+    print(f'Latency: p50 {percentile(latencies, 0.5) / 1000:.1f} us, '
+          f'p99 {percentile(latencies, 0.99) / 1000:.1f} us, '
+          f'max {latencies[-1] / 1000:.1f} us')
+    print(f'XP awarded: {xp_awarded} of {len(latencies)} messages')
+    print(f'Sends: {sends["channel"]} channel messages, {sends["command"]} command replies')
+
+
+if __name__ == '__main__':
+    main()
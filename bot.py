@@ -1,13 +1,31 @@
+import time
+# Startup phases are timed from here, so importing discord.py is included
+BOOT_STARTED = time.perf_counter()
+
 import discord
 from discord import app_commands, ui
 from discord.ext import commands, tasks
+import hashlib
 import json
+import math
 import os
 import re
 from datetime import datetime, timedelta
 from pathlib import Path
 import asyncio
+import heapq
 import random
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+from leaderboard import GuildRanking
+from members import Balance, LevelEntry, MemberMap, Protection
+from columns import ColumnStore
+from entrants import EntrantLog
+from levelfile import LevelFile
+from partitions import PartitionedStore
+from sampling import weighted_sample
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -24,103 +42,304 @@ bot = commands.Bot(command_prefix=get_command_prefix, intents=intents, help_comm
 DATA_DIR = Path('data')
 DATA_DIR.mkdir(exist_ok=True)
 
-CONFIG_FILE = DATA_DIR / 'config.json'
-LEVELS_FILE = DATA_DIR / 'levels.json'
-MUTES_FILE = DATA_DIR / 'mutes.json'
-WARNS_FILE = DATA_DIR / 'warns.json'
-GAMBLING_FILE = DATA_DIR / 'gambling.json'
-AFK_FILE = DATA_DIR / 'afk.json'
-PROTECTIONS_FILE = DATA_DIR / 'protections.json'
-COMMAND_PENALTIES_FILE = DATA_DIR / 'command_penalties.json'
-LEVEL_BLACKLIST_FILE = DATA_DIR / 'level_blacklist.json'
-GIVEAWAYS_FILE = DATA_DIR / 'giveaways.json'
+# STORAGE_BACKEND=sqlite keeps the stores in data/bot.db instead of one JSON
+# file per store. Run `python storage.py migrate` once to import the JSON files.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+SQLITE_PATH = Path(os.getenv('SQLITE_PATH', DATA_DIR / 'bot.db'))
+
+# With the JSON backend, XP changes are appended to data/levels.journal and
+# folded back into levels.json once the journal reaches JOURNAL_COMPACT_BYTES.
+XP_JOURNAL = os.getenv('XP_JOURNAL', '1') != '0'
+JOURNAL_COMPACT_BYTES = int(os.getenv('JOURNAL_COMPACT_BYTES', 4 * 1024 * 1024))
+
+if STORAGE_BACKEND == 'sqlite':
+    storage_backend = storage.SQLiteBackend(SQLITE_PATH)
+else:
+    storage_backend = storage.JSONBackend(DATA_DIR, journal=XP_JOURNAL, compact_bytes=JOURNAL_COMPACT_BYTES)
+
+# COLUMN_STORE=1 keeps levels and balances in per-guild typed arrays
+# (columns.ColumnStore) instead of one object per member.
+COLUMN_STORE = os.getenv('COLUMN_STORE', '0') == '1'
+NumericMemberStore = ColumnStore if COLUMN_STORE else MemberMap
+
+# LEVELS_FILE=1 keeps levels in a memory-mapped data/levels.bin instead of
+# the storage backend. XP changes are written into the file in place, so the
+# levels store is never saved. The file is created from the backend's levels
+# data the first time.
+LEVELS_FILE = os.getenv('LEVELS_FILE', '0') == '1'
+LEVELS_FILE_PATH = DATA_DIR / 'levels.bin'
+
+# LAZY_GUILDS=1 splits levels, warns and gambling into one file per guild
+# under data/guilds/ and loads a guild's members the first time it is used.
+# Guilds idle for GUILD_IDLE_SECONDS, and the least recently used beyond
+# MAX_LOADED_GUILDS, are dropped again by the evict_guilds loop.
+LAZY_GUILDS = os.getenv('LAZY_GUILDS', '0') == '1'
+PARTITION_DIR = DATA_DIR / 'guilds'
+GUILD_IDLE_SECONDS = float(os.getenv('GUILD_IDLE_SECONDS', '1800'))
+MAX_LOADED_GUILDS = int(os.getenv('MAX_LOADED_GUILDS', '1000'))
 
 config = {
     'bot_owner': '',
     'prefixes': {},
     'owners': {},
     'admins': {},
-    'welcome_dm': {}
+    'welcome_dm': {},
+    'raid_protection': {}
 }
 
-levels = {}
+levels = NumericMemberStore(LevelEntry)
 active_mutes = {}
-warns = {}
-gambling_data = {}
+warns = MemberMap()
+gambling_data = NumericMemberStore(Balance)
 afk_users = {}
-protections = {}
+protections = MemberMap(Protection)
 command_penalties = {}
 level_blacklist = {}
 giveaways = {}
+# Entrants of button giveaways, appended to one file per giveaway
+giveaway_entrants = EntrantLog(DATA_DIR / 'giveaway_entrants')
+
+# Guild ID -> GuildRanking, kept in step with levels by update_leaderboard()
+leaderboards = {}
+
+# Store name -> accessor. The accessor is looked up at save time because
+# load_data() rebinds the module-level dicts.
+STORES = {
+    'config': lambda: config,
+    'levels': lambda: levels,
+    'mutes': lambda: active_mutes,
+    'warns': lambda: warns,
+    'gambling': lambda: gambling_data,
+    'afk': lambda: afk_users,
+    'protections': lambda: protections,
+    'command_penalties': lambda: command_penalties,
+    'level_blacklist': lambda: level_blacklist,
+    'giveaways': lambda: giveaways,
+    'giveaway_entrants': lambda: giveaway_entrants
+}
+
+# Store name -> set of dirty keys, or None when the whole store is dirty
+dirty_stores = {}
+
+# Write-behind persistence: mutations only mark stores dirty and the
+# flush_data loop writes them from a worker thread once the store has been
+# quiet for SAVE_INTERVAL seconds, once the oldest unsaved change is
+# SAVE_MAX_AGE seconds old, or once SAVE_MAX_PENDING changes have piled up.
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', '1') != '0'
+SAVE_INTERVAL = float(os.getenv('SAVE_INTERVAL', '5'))
+SAVE_MAX_AGE = float(os.getenv('SAVE_MAX_AGE', '30'))
+SAVE_MAX_PENDING = int(os.getenv('SAVE_MAX_PENDING', '500'))
+
+pending_saves = 0
+first_dirty_at = 0.0
+last_dirty_at = 0.0
+
+# Only one flush writes at a time, so files are replaced in the order their
+# snapshots were taken. Synchronous saves that arrive while a flush is in
+# its worker thread are left dirty and written by that flush afterwards.
+flush_lock = asyncio.Lock()
+sync_flush_pending = False
+
+def load_stores(names):
+    # Each store is read and parsed in its own worker thread
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        return dict(zip(names, pool.map(storage_backend.load, names)))
 
 def load_data():
-    global config, levels, active_mutes, warns, gambling_data, afk_users, protections, command_penalties
+    global config, levels, active_mutes, warns, gambling_data, afk_users, protections, command_penalties, level_blacklist, giveaways
     try:
-        if CONFIG_FILE.exists():
-            with open(CONFIG_FILE, 'r') as f:
-                loaded_config = json.load(f)
-                config['bot_owner'] = loaded_config.get('bot_owner', loaded_config.get('botOwner', ''))
-                config['prefixes'] = loaded_config.get('prefixes', {})
-                config['owners'] = loaded_config.get('owners', {})
-                config['admins'] = loaded_config.get('admins', {})
-                config['welcome_dm'] = loaded_config.get('welcome_dm', loaded_config.get('welcomeDM', {}))
-        if LEVELS_FILE.exists():
-            with open(LEVELS_FILE, 'r') as f:
-                levels = json.load(f)
-        if MUTES_FILE.exists():
-            with open(MUTES_FILE, 'r') as f:
-                active_mutes = json.load(f)
-        if WARNS_FILE.exists():
-            with open(WARNS_FILE, 'r') as f:
-                warns = json.load(f)
-        if GAMBLING_FILE.exists():
-            with open(GAMBLING_FILE, 'r') as f:
-                gambling_data = json.load(f)
-        if AFK_FILE.exists():
-            with open(AFK_FILE, 'r') as f:
-                afk_users = json.load(f)
-        if PROTECTIONS_FILE.exists():
-            with open(PROTECTIONS_FILE, 'r') as f:
-                protections = json.load(f)
-        if COMMAND_PENALTIES_FILE.exists():
-            with open(COMMAND_PENALTIES_FILE, 'r') as f:
-                command_penalties = json.load(f)
-        if LEVEL_BLACKLIST_FILE.exists():
-            with open(LEVEL_BLACKLIST_FILE, 'r') as f:
-                level_blacklist = json.load(f)
-        if GIVEAWAYS_FILE.exists():
-            with open(GIVEAWAYS_FILE, 'r') as f:
-                giveaways = json.load(f)
+        names = ['config', 'mutes', 'afk', 'protections', 'command_penalties', 'level_blacklist', 'giveaways']
+        if not LEVELS_FILE and not LAZY_GUILDS:
+            names.append('levels')
+        if not LAZY_GUILDS:
+            names += ['warns', 'gambling']
+        loaded = load_stores(names)
+
+        loaded_config = loaded['config']
+        if loaded_config is not None:
+            config['bot_owner'] = loaded_config.get('bot_owner', loaded_config.get('botOwner', ''))
+            config['prefixes'] = loaded_config.get('prefixes', {})
+            config['owners'] = loaded_config.get('owners', {})
+            config['admins'] = loaded_config.get('admins', {})
+            config['welcome_dm'] = loaded_config.get('welcome_dm', loaded_config.get('welcomeDM', {}))
+            config['raid_protection'] = loaded_config.get('raid_protection', {})
+        # Member stores are re-keyed by int IDs in memory
+        if LEVELS_FILE:
+            levels = open_levels_file()
+        elif LAZY_GUILDS:
+            levels = open_partitioned_store('levels', LevelEntry, on_load=build_leaderboard, on_evict=drop_leaderboard)
+        else:
+            levels = NumericMemberStore.from_store(loaded['levels'], LevelEntry)
+        active_mutes = loaded['mutes'] or active_mutes
+        if LAZY_GUILDS:
+            warns = open_partitioned_store('warns')
+            gambling_data = open_partitioned_store('gambling', Balance)
+        else:
+            warns = MemberMap.from_store(loaded['warns'])
+            gambling_data = NumericMemberStore.from_store(loaded['gambling'], Balance)
+        afk_users = loaded['afk'] or afk_users
+        protections = MemberMap.from_store(loaded['protections'], Protection)
+        command_penalties = loaded['command_penalties'] or command_penalties
+        level_blacklist = loaded['level_blacklist'] or level_blacklist
+        giveaways = loaded['giveaways'] or giveaways
+        import_giveaway_entrants()
     except Exception as e:
         print(f'Error loading data: {e}')
 
-def save_data():
-    try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
-        with open(LEVELS_FILE, 'w') as f:
-            json.dump(levels, f, indent=2)
-        with open(MUTES_FILE, 'w') as f:
-            json.dump(active_mutes, f, indent=2)
-        with open(WARNS_FILE, 'w') as f:
-            json.dump(warns, f, indent=2)
-        with open(GAMBLING_FILE, 'w') as f:
-            json.dump(gambling_data, f, indent=2)
-        with open(AFK_FILE, 'w') as f:
-            json.dump(afk_users, f, indent=2)
-        with open(PROTECTIONS_FILE, 'w') as f:
-            json.dump(protections, f, indent=2)
-        with open(COMMAND_PENALTIES_FILE, 'w') as f:
-            json.dump(command_penalties, f, indent=2)
-        with open(LEVEL_BLACKLIST_FILE, 'w') as f:
-            json.dump(level_blacklist, f, indent=2)
-        with open(GIVEAWAYS_FILE, 'w') as f:
-            json.dump(giveaways, f, indent=2)
-    except Exception as e:
-        print(f'Error saving data: {e}')
+    rebuild_leaderboards()
+    rebuild_guild_states()
+    schedule_loaded_expiries()
+
+    if STORAGE_BACKEND == 'sqlite' and storage_backend.is_new and (DATA_DIR / 'levels.json').exists():
+        print('SQLite database is empty but JSON data exists. Run `python storage.py migrate` to import it.')
+
+def open_levels_file():
+    if LEVELS_FILE_PATH.exists():
+        return LevelFile.open(LEVELS_FILE_PATH)
+    levels_file = LevelFile.from_store(LEVELS_FILE_PATH, storage_backend.load('levels'))
+    print(f'Created {LEVELS_FILE_PATH} with {len(levels_file)} members')
+    return levels_file
+
+def open_partitioned_store(name, record=None, **hooks):
+    directory = PARTITION_DIR / name
+    if not directory.exists():
+        count = PartitionedStore.split(directory, storage_backend.load(name))
+        print(f'Split {name} into {count} guild files')
+    return PartitionedStore(directory, record, **hooks)
+
+def store_backend(name):
+    # Partitioned stores and the entrant log write their own files
+    data = STORES[name]()
+    return data if isinstance(data, (PartitionedStore, EntrantLog)) else storage_backend
+
+def mark_dirty(store, keys):
+    if store == 'levels' and LEVELS_FILE:
+        return
+    if not keys:
+        dirty_stores[store] = None
+    elif store not in dirty_stores:
+        dirty_stores[store] = set(keys)
+    elif dirty_stores[store] is not None:
+        dirty_stores[store].update(keys)
+
+def prepare_dirty_stores():
+    # Runs on the event loop: hand each dirty store to the backend and
+    # reset the dirty set. The returned payloads are written off-loop.
+    payloads = {}
+    for name, keys in dirty_stores.items():
+        try:
+            payloads[name] = store_backend(name).prepare(name, STORES[name](), keys)
+        except Exception as e:
+            print(f'Error preparing {name} for saving: {e}')
+    dirty_stores.clear()
+    return payloads
+
+def write_stores(payloads):
+    failed = []
+    for name, payload in payloads.items():
+        try:
+            store_backend(name).write(name, payload)
+        except Exception as e:
+            print(f'Error saving {name}: {e}')
+            failed.append(name)
+    return failed
+
+def save_data(store=None, *keys):
+    # Mark a store (or only the given keys of it) dirty. Calling without
+    # arguments marks every store.
+    global pending_saves, first_dirty_at, last_dirty_at
+    if store is None:
+        for name in STORES:
+            mark_dirty(name, None)
+    else:
+        mark_dirty(store, keys)
+
+    if WRITE_BEHIND and flush_data.is_running():
+        now = time.monotonic()
+        if pending_saves == 0:
+            first_dirty_at = now
+        last_dirty_at = now
+        pending_saves += 1
+        return
+
+    # No flush loop running (startup, shutdown, or write-behind disabled)
+    flush_dirty_stores_sync()
+
+def flush_dirty_stores_sync():
+    global sync_flush_pending
+    if flush_lock.locked():
+        sync_flush_pending = True
+        return
+    for name in write_stores(prepare_dirty_stores()):
+        mark_dirty(name, None)
+
+async def flush_dirty_stores():
+    global pending_saves, sync_flush_pending
+    async with flush_lock:
+        while True:
+            sync_flush_pending = False
+            payloads = prepare_dirty_stores()
+            pending_saves = 0
+
+            failed = await asyncio.to_thread(write_stores, payloads)
+            for name in failed:
+                mark_dirty(name, None)
+            if not sync_flush_pending:
+                break
+
+# Per-guild settings for the on_message path, keyed by int IDs so a message
+# needs no key strings. The stores remain the source of truth: everything
+# that changes a prefix, the level blacklist or an AFK status updates the
+# guild's state as well.
+class GuildState:
+    __slots__ = ('prefix', 'level_blacklist', 'afk', 'cooldowns')
+
+    def __init__(self, guild_id):
+        self.prefix = '?'
+        self.level_blacklist = set()
+        # user ID -> the record shared with afk_users
+        self.afk = {}
+        # user ID -> monotonic time of the last message that earned XP
+        self.cooldowns = {}
+        self.load_settings(guild_id)
+
+    def load_settings(self, guild_id):
+        self.prefix = config['prefixes'].get(str(guild_id), '?')
+        self.level_blacklist = {int(channel_id) for channel_id in level_blacklist.get(str(guild_id), [])}
+
+guild_states = {}
+
+def get_guild_state(guild_id):
+    state = guild_states.get(guild_id)
+    if state is None:
+        state = guild_states[guild_id] = GuildState(guild_id)
+    return state
+
+def refresh_guild_settings(guild_id):
+    state = guild_states.get(int(guild_id))
+    if state:
+        state.load_settings(guild_id)
+
+def rebuild_guild_states():
+    guild_states.clear()
+    for key, afk_data in afk_users.items():
+        guild_id, user_id = key.split('-')
+        get_guild_state(int(guild_id)).afk[int(user_id)] = afk_data
+
+def set_afk(guild_id, user_id, reason):
+    key = f'{guild_id}-{user_id}'
+    afk_users[key] = {'reason': reason, 'timestamp': datetime.now().timestamp()}
+    get_guild_state(guild_id).afk[user_id] = afk_users[key]
+    save_data('afk', key)
+
+def clear_afk(guild_id, user_id):
+    key = f'{guild_id}-{user_id}'
+    get_guild_state(guild_id).afk.pop(user_id, None)
+    if afk_users.pop(key, None) is not None:
+        save_data('afk', key)
 
 def get_prefix(guild_id):
-    return config['prefixes'].get(str(guild_id), '?')
+    return get_guild_state(int(guild_id)).prefix
 
 def is_bot_owner(user_id):
     return str(user_id) == config['bot_owner']
@@ -150,19 +369,69 @@ def get_user_badge(guild_id, user_id):
         return 'ADMIN 🛡️'
     return ''
 
+# Names of users fetched over REST: user ID -> (name, fetched_at), oldest first
+USER_CACHE_SIZE = 5000
+USER_CACHE_TTL = 3600
+USER_FETCH_CONCURRENCY = 5
+
+user_name_cache = OrderedDict()
+user_fetch_semaphore = asyncio.Semaphore(USER_FETCH_CONCURRENCY)
+
+async def fetch_user_name(user_id):
+    async with user_fetch_semaphore:
+        try:
+            user = await bot.fetch_user(user_id)
+        except Exception as e:
+            print(f'Could not fetch user {user_id}: {e}')
+            return None
+
+    user_name_cache[user_id] = (user.name, time.monotonic())
+    user_name_cache.move_to_end(user_id)
+    while len(user_name_cache) > USER_CACHE_SIZE:
+        user_name_cache.popitem(last=False)
+    return user.name
+
+async def resolve_user_names(user_ids, guild=None):
+    # Member cache first, then the client's user cache, then names fetched
+    # earlier, and only then REST, with the misses fetched concurrently.
+    names = {}
+    missing = []
+    now = time.monotonic()
+
+    for user_id in dict.fromkeys(int(u) for u in user_ids):
+        user = (guild.get_member(user_id) if guild else None) or bot.get_user(user_id)
+        if user:
+            names[user_id] = user.name
+            continue
+
+        cached = user_name_cache.get(user_id)
+        if cached and now - cached[1] < USER_CACHE_TTL:
+            user_name_cache.move_to_end(user_id)
+            names[user_id] = cached[0]
+            continue
+
+        missing.append(user_id)
+
+    fetched = await asyncio.gather(*(fetch_user_name(user_id) for user_id in missing))
+    for user_id, name in zip(missing, fetched):
+        if name is not None:
+            names[user_id] = name
+
+    return names
+
+MAX_LEVEL = 1000
+
 def get_messages_for_level(level):
     return level * 10
 
-def get_level_from_xp(xp):
-    level = 0
-    total_messages = 0
+def get_xp_for_level(level):
+    # Total messages needed to reach a level: 10 + 20 + ... + level * 10
+    return 5 * level * (level + 1)
 
-    while level < 1000:
-        messages_needed = get_messages_for_level(level + 1)
-        if total_messages + messages_needed > xp:
-            break
-        total_messages += messages_needed
-        level += 1
+def get_level_from_xp(xp):
+    # Largest level with 5 * level * (level + 1) <= xp
+    level = min((math.isqrt(4 * (max(xp, 0) // 5) + 1) - 1) // 2, MAX_LEVEL)
+    total_messages = get_xp_for_level(level)
 
     return {
         'level': level,
@@ -170,29 +439,190 @@ def get_level_from_xp(xp):
         'messages_needed': get_messages_for_level(level + 1)
     }
 
-def add_xp(guild_id, user_id):
-    key = f'{guild_id}-{user_id}'
-    if key not in levels:
-        levels[key] = {'xp': 0, 'last_message': 0}
+def get_xp_to_add_levels(xp, amount):
+    # XP that moves a user up `amount` levels while keeping their progress
+    # into the current level. Past MAX_LEVEL every extra level costs the
+    # same as the one after the cap.
+    level = get_level_from_xp(xp)['level']
+    target = level + amount
+    if target <= MAX_LEVEL:
+        return get_xp_for_level(target) - get_xp_for_level(level)
+    return (get_xp_for_level(MAX_LEVEL) - get_xp_for_level(level) +
+            (target - MAX_LEVEL) * get_messages_for_level(MAX_LEVEL + 1))
+
+def get_xp_to_remove_levels(level, amount):
+    # XP for levels level - amount + 1 through level
+    return get_xp_for_level(level) - get_xp_for_level(level - amount)
+
+def rebuild_leaderboards():
+    leaderboards.clear()
+    for guild_id in levels.guild_ids():
+        build_leaderboard(guild_id)
+
+def build_leaderboard(guild_id):
+    leaderboards[guild_id] = GuildRanking(levels.pairs(guild_id, 'xp'))
+
+def drop_leaderboard(guild_id):
+    leaderboards.pop(guild_id, None)
+
+def get_leaderboard(guild_id):
+    # A partitioned levels store builds the ranking when the guild loads
+    if isinstance(levels, PartitionedStore):
+        levels.load(guild_id)
+    return leaderboards.get(guild_id)
+
+def update_leaderboard(guild_id, user_id, xp):
+    guild_id = int(guild_id)
+    if guild_id not in leaderboards:
+        leaderboards[guild_id] = GuildRanking()
+    leaderboards[guild_id].update(int(user_id), xp)
+
+def get_member_rank(guild_id, user_id):
+    ranking = get_leaderboard(int(guild_id))
+    if not ranking or int(user_id) not in ranking:
+        return None
 
-    if 'last_message' not in levels[key]:
-        levels[key]['last_message'] = 0
+    # The bot owner is always listed first on the leaderboard
+    offset = 1 if config['bot_owner'] else 0
+    xp = ranking.get_xp(int(user_id))
+    above = ranking.next_above(xp)
 
-    now = datetime.now().timestamp()
-    if now - levels[key]['last_message'] < 1:
+    return {
+        'rank': ranking.rank(int(user_id)) + offset,
+        'xp': xp,
+        'next_rank': above[1] + offset if above else None,
+        'gap': above[0] - xp if above else 0
+    }
+
+LEVELBOARD_PAGE_SIZE = 10
+
+async def build_levelboard_page(guild, page):
+    # Pages are slices of the guild's live ranking; only the names on the
+    # requested page are resolved, and those usually come from cache
+    ranking = get_leaderboard(guild.id)
+    total = len(ranking) if ranking else 0
+    pages = max(1, math.ceil(total / LEVELBOARD_PAGE_SIZE))
+    page = max(0, min(page, pages - 1))
+    entries = ranking.top(LEVELBOARD_PAGE_SIZE, page * LEVELBOARD_PAGE_SIZE) if ranking else []
+    show_owner = bool(config['bot_owner']) and page == 0
+
+    if not entries and not config['bot_owner']:
+        return 'No level data available yet!', page, pages
+
+    user_ids = [user_id for user_id, _ in entries]
+    if show_owner:
+        user_ids.append(config['bot_owner'])
+    names = await resolve_user_names(user_ids, guild)
+
+    leaderboard = '🏆 **Level Leaderboard**\n\n'
+    if show_owner and int(config['bot_owner']) in names:
+        badge = get_user_badge(guild.id, config['bot_owner'])
+        badge_text = f' {badge}' if badge else ''
+        leaderboard += f'1. {names[int(config["bot_owner"])]} - Level **∞** (∞ messages){badge_text}\n'
+
+    offset = 1 if config['bot_owner'] else 0
+    for user_id, xp in entries:
+        if str(user_id) == config['bot_owner'] or user_id not in names:
+            continue
+        badge = get_user_badge(guild.id, user_id)
+        badge_text = f' {badge}' if badge else ''
+        level = get_level_from_xp(xp)['level']
+        leaderboard += f'{ranking.rank(user_id) + offset}. {names[user_id]} - Level **{level}** ({xp} messages){badge_text}\n'
+
+    if pages > 1:
+        leaderboard += f'\nPage {page + 1}/{pages}'
+    return leaderboard, page, pages
+
+class LevelboardView(ui.View):
+    def __init__(self, guild, user_id, page, pages):
+        super().__init__(timeout=120)
+        self.guild = guild
+        self.user_id = user_id
+        self.page = page
+        self.pages = pages
+        self.message = None
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.prev_button.disabled = self.page <= 0
+        self.next_button.disabled = self.page >= self.pages - 1
+
+    async def show_page(self, interaction, page):
+        if interaction.user.id != self.user_id:
+            return await interaction.response.send_message('This is not your leaderboard!', ephemeral=True)
+        content, self.page, self.pages = await build_levelboard_page(self.guild, page)
+        self.update_buttons()
+        await interaction.response.edit_message(content=content, view=self)
+
+    @ui.button(label='Prev', style=discord.ButtonStyle.secondary, emoji='◀️')
+    async def prev_button(self, interaction: discord.Interaction, button: ui.Button):
+        await self.show_page(interaction, self.page - 1)
+
+    @ui.button(label='Next', style=discord.ButtonStyle.secondary, emoji='▶️')
+    async def next_button(self, interaction: discord.Interaction, button: ui.Button):
+        await self.show_page(interaction, self.page + 1)
+
+    async def on_timeout(self):
+        if self.message:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+# XP earned since the last commit: (guild_id, user_id) -> amount. The
+# commit_xp loop folds it into levels in one batch, so a message only bumps
+# a counter. Cooldowns live in GuildState and are never persisted.
+XP_COMMIT_INTERVAL = float(os.getenv('XP_COMMIT_INTERVAL', '10'))
+XP_COOLDOWN = 1
+pending_xp = Counter()
+
+def get_user_xp(guild_id, user_id):
+    guild_id, user_id = int(guild_id), int(user_id)
+    entry = levels.get(guild_id, user_id)
+    return (entry.xp if entry else 0) + pending_xp.get((guild_id, user_id), 0)
+
+def commit_pending_xp(members=None):
+    # Fold pending XP into levels, for everyone or only the given
+    # (guild_id, user_id) pairs
+    if members is None:
+        members = list(pending_xp)
+
+    keys = []
+    for guild_id, user_id in members:
+        amount = pending_xp.pop((guild_id, user_id), 0)
+        if not amount:
+            continue
+        entry = levels.get(guild_id, user_id)
+        if entry:
+            entry.xp += amount
+        else:
+            levels.set(guild_id, user_id, LevelEntry(amount))
+        keys.append(f'{guild_id}-{user_id}')
+
+    if keys:
+        save_data('levels', *keys)
+
+def add_xp(guild_id, user_id, state=None):
+    state = state or get_guild_state(guild_id)
+    now = time.monotonic()
+    if now - state.cooldowns.get(user_id, -XP_COOLDOWN) < XP_COOLDOWN:
         return None
 
-    old_level = get_level_from_xp(levels[key]['xp'])['level']
-    levels[key]['xp'] += 1
-    levels[key]['last_message'] = now
-    new_level = get_level_from_xp(levels[key]['xp'])['level']
-    save_data()
+    state.cooldowns[user_id] = now
+    pending_xp[(guild_id, user_id)] += 1
+    xp = get_user_xp(guild_id, user_id)
+    update_leaderboard(guild_id, user_id, xp)
 
-    # Return new level if user leveled up
-    if new_level > old_level:
-        return new_level
+    # XP only grows one at a time here, so a level-up is exactly the
+    # message that lands on a level's threshold
+    level = get_level_from_xp(xp)['level']
+    if level > 0 and xp == get_xp_for_level(level):
+        return level
     return None
 
+# Discord rejects timeouts longer than this
+MAX_TIMEOUT_SECONDS = 28 * 24 * 3600
+
 def parse_duration(duration_str):
     pattern = r'(\d+)\s*(seconds?|secs?|s|minutes?|mins?|m|hours?|hrs?|h|days?|d|weeks?|wks?|w)(?:\s|$)'
     matches = re.findall(pattern, duration_str.lower())
@@ -261,19 +691,10 @@ def format_duration(seconds):
     return ', '.join(parts)
 
 def is_protected(guild_id, user_id):
-    key = f'{guild_id}-{user_id}'
-    if key not in protections:
+    protection_data = protections.get(guild_id, user_id)
+    if not protection_data:
         return False
-
-    protection_data = protections[key]
-
-    if protection_data.get('infinite', False):
-        return True
-
-    if protection_data['end_time'] <= datetime.now().timestamp():
-        return False
-
-    return True
+    return protection_data.is_active(datetime.now().timestamp())
 
 def is_command_banned(user_id):
     user_id_str = str(user_id)
@@ -298,15 +719,12 @@ def is_command_muted(user_id):
     return True
 
 def get_user_balance(guild_id, user_id):
-    key = f'{guild_id}-{user_id}'
-    if key not in gambling_data:
-        gambling_data[key] = {
-            'coins': 1000,
-            'last_daily': 0,
-            'items': []
-        }
-        save_data()
-    return gambling_data[key]
+    balance = gambling_data.get(guild_id, user_id)
+    if balance is None:
+        gambling_data.set(guild_id, user_id, Balance())
+        balance = gambling_data.get(guild_id, user_id)
+        save_data('gambling', f'{guild_id}-{user_id}')
+    return balance
 
 class GambleView(ui.View):
     def __init__(self, interaction, amount):
@@ -324,17 +742,17 @@ class GambleView(ui.View):
         bot_choice = random.choice(['Heads', 'Tails'])
 
         if user_choice == bot_choice:
-            user_data['coins'] += self.amount
-            save_data()
+            user_data.coins += self.amount
+            save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
             await interaction.response.edit_message(
-                content=f'🪙 **Coin Flip**\n\nYou got: **{user_choice}**\nBot got: **{bot_choice}**\n\n🎉 You won **{self.amount}** coins!\nNew balance: **{user_data["coins"]}** coins',
+                content=f'🪙 **Coin Flip**\n\nYou got: **{user_choice}**\nBot got: **{bot_choice}**\n\n🎉 You won **{self.amount}** coins!\nNew balance: **{user_data.coins}** coins',
                 view=None
             )
         else:
-            user_data['coins'] -= self.amount
-            save_data()
+            user_data.coins -= self.amount
+            save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
             await interaction.response.edit_message(
-                content=f'🪙 **Coin Flip**\n\nYou got: **{user_choice}**\nBot got: **{bot_choice}**\n\n😢 You lost **{self.amount}** coins!\nNew balance: **{user_data["coins"]}** coins',
+                content=f'🪙 **Coin Flip**\n\nYou got: **{user_choice}**\nBot got: **{bot_choice}**\n\n😢 You lost **{self.amount}** coins!\nNew balance: **{user_data.coins}** coins',
                 view=None
             )
 
@@ -348,22 +766,22 @@ class GambleView(ui.View):
         bot_roll = random.randint(1, 6)
 
         if user_roll > bot_roll:
-            user_data['coins'] += self.amount
-            save_data()
+            user_data.coins += self.amount
+            save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
             await interaction.response.edit_message(
-                content=f'🎲 **Dice Roll**\n\nYou rolled: **{user_roll}**\nBot rolled: **{bot_roll}**\n\n🎉 You won **{self.amount}** coins!\nNew balance: **{user_data["coins"]}** coins',
+                content=f'🎲 **Dice Roll**\n\nYou rolled: **{user_roll}**\nBot rolled: **{bot_roll}**\n\n🎉 You won **{self.amount}** coins!\nNew balance: **{user_data.coins}** coins',
                 view=None
             )
         elif user_roll < bot_roll:
-            user_data['coins'] -= self.amount
-            save_data()
+            user_data.coins -= self.amount
+            save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
             await interaction.response.edit_message(
-                content=f'🎲 **Dice Roll**\n\nYou rolled: **{user_roll}**\nBot rolled: **{bot_roll}**\n\n😢 You lost **{self.amount}** coins!\nNew balance: **{user_data["coins"]}** coins',
+                content=f'🎲 **Dice Roll**\n\nYou rolled: **{user_roll}**\nBot rolled: **{bot_roll}**\n\n😢 You lost **{self.amount}** coins!\nNew balance: **{user_data.coins}** coins',
                 view=None
             )
         else:
             await interaction.response.edit_message(
-                content=f'🎲 **Dice Roll**\n\nYou rolled: **{user_roll}**\nBot rolled: **{bot_roll}**\n\n🤝 It\'s a tie! No coins lost or won.\nBalance: **{user_data["coins"]}** coins',
+                content=f'🎲 **Dice Roll**\n\nYou rolled: **{user_roll}**\nBot rolled: **{bot_roll}**\n\n🤝 It\'s a tie! No coins lost or won.\nBalance: **{user_data.coins}** coins',
                 view=None
             )
 
@@ -376,17 +794,17 @@ class GambleView(ui.View):
         number = random.randint(1, 100)
 
         if number >= 50:
-            user_data['coins'] += self.amount
-            save_data()
+            user_data.coins += self.amount
+            save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
             await interaction.response.edit_message(
-                content=f'🎰 **High/Low**\n\nThe number was: **{number}**\n\n🎉 You won **{self.amount}** coins!\nNew balance: **{user_data["coins"]}** coins',
+                content=f'🎰 **High/Low**\n\nThe number was: **{number}**\n\n🎉 You won **{self.amount}** coins!\nNew balance: **{user_data.coins}** coins',
                 view=None
             )
         else:
-            user_data['coins'] -= self.amount
-            save_data()
+            user_data.coins -= self.amount
+            save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
             await interaction.response.edit_message(
-                content=f'🎰 **High/Low**\n\nThe number was: **{number}**\n\n😢 You lost **{self.amount}** coins!\nNew balance: **{user_data["coins"]}** coins',
+                content=f'🎰 **High/Low**\n\nThe number was: **{number}**\n\n😢 You lost **{self.amount}** coins!\nNew balance: **{user_data.coins}** coins',
                 view=None
             )
 
@@ -411,8 +829,103 @@ def get_command_penalty_message(user_id):
 
     return None
 
-@bot.tree.interaction_check
+# Slash commands must respond within 3 seconds. Every command gets an
+# AutoDeferResponse that defers it once AUTO_DEFER_AFTER seconds pass
+# without a response; send_message calls after that go out as followups.
+# The timer is stopped when the command returns or raises. A deferred
+# interaction can no longer open a modal, so commands that do are listed
+# in NO_AUTO_DEFER and keep the plain response.
+AUTO_DEFER_AFTER = float(os.getenv('AUTO_DEFER_AFTER', '2'))
+NO_AUTO_DEFER = set()
+
+# The wrapper is installed in the slot that caches Interaction.response
+if '_cs_response' not in discord.Interaction.__slots__:
+    raise RuntimeError(f'discord.py {discord.__version__} no longer caches Interaction.response in _cs_response; update AutoDeferResponse')
+
+# Command name -> [responses, total ms to first response, slowest ms, auto-deferred]
+command_timings = {}
+
+class AutoDeferResponse(discord.InteractionResponse):
+    def __init__(self, parent, command_name):
+        super().__init__(parent)
+        self.command_name = command_name
+        self.started_at = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.auto_deferred = False
+        self.followed_up = False
+        self.timer = asyncio.create_task(self.defer_after(AUTO_DEFER_AFTER))
+
+    def record_first_response(self):
+        if self.timer is not asyncio.current_task():
+            self.timer.cancel()
+        elapsed = (time.monotonic() - self.started_at) * 1000
+        stats = command_timings.setdefault(self.command_name, [0, 0.0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        if self.auto_deferred:
+            stats[3] += 1
+
+    async def defer_after(self, delay):
+        await asyncio.sleep(delay)
+        async with self.lock:
+            if self.is_done():
+                return
+            try:
+                await super().defer(thinking=True)
+            except discord.HTTPException as e:
+                print(f'Could not defer /{self.command_name}: {e}')
+                return
+            self.auto_deferred = True
+            self.record_first_response()
+
+    async def defer(self, **kwargs):
+        async with self.lock:
+            if self.auto_deferred:
+                return
+            await super().defer(**kwargs)
+            self.record_first_response()
+
+    async def send_message(self, content=None, **kwargs):
+        async with self.lock:
+            if not self.auto_deferred:
+                await super().send_message(content, **kwargs)
+                self.record_first_response()
+                return
+        await self.send_followup(content, **kwargs)
+
+    async def send_modal(self, modal):
+        # Raises InteractionResponded once auto-deferred (see NO_AUTO_DEFER)
+        async with self.lock:
+            await super().send_modal(modal)
+            self.record_first_response()
+
+    def stop(self):
+        self.timer.cancel()
+
+    async def send_followup(self, content=None, *, ephemeral=False, delete_after=None, **kwargs):
+        if ephemeral and not self.followed_up:
+            # The "thinking" message from the deferral is public; remove it
+            # so the ephemeral reply is not shown in its place
+            try:
+                await self._parent.delete_original_response()
+            except discord.HTTPException:
+                pass
+        self.followed_up = True
+
+        if content is not None:
+            kwargs['content'] = content
+        message = await self._parent.followup.send(ephemeral=ephemeral, wait=True, **kwargs)
+        if delete_after is not None:
+            await message.delete(delay=delete_after)
+
 async def interaction_check(interaction) -> bool:
+    if interaction.type is discord.InteractionType.application_command:
+        command = interaction.command
+        command_name = command.qualified_name if command else interaction.data.get('name', 'unknown')
+        if command_name not in NO_AUTO_DEFER:
+            interaction._cs_response = AutoDeferResponse(interaction, command_name)
+
     if interaction.user.bot:
         return True
 
@@ -431,195 +944,681 @@ async def interaction_check(interaction) -> bool:
 
     return True
 
-@tasks.loop(seconds=30)
-async def check_mutes():
-    now = datetime.now().timestamp()
-    to_remove = []
+bot.tree.interaction_check = interaction_check
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    # A command that returned without responding gets Discord's own
+    # "did not respond" error rather than an endless "thinking"
+    if isinstance(interaction.response, AutoDeferResponse):
+        interaction.response.stop()
+
+async def on_app_command_error(interaction, error):
+    command_name = interaction.command.qualified_name if interaction.command else 'unknown'
+    print(f'Error in /{command_name}: {error}')
+    response = interaction.response
+    if not isinstance(response, AutoDeferResponse):
+        return
+    response.stop()
+    if response.auto_deferred:
+        try:
+            await response.send_followup('❌ Something went wrong while running this command.', ephemeral=True)
+        except discord.HTTPException:
+            pass
+
+bot.tree.on_error = on_app_command_error
+
+# Expiry scheduler: a min-heap of (end_time, store, key) for every timed
+# record, and one loop that sleeps until the earliest deadline. Removing or
+# extending a record leaves its old entry behind; the expire handlers
+# re-check the record and ignore entries that are no longer due.
+EXPIRY_RETRY_DELAY = 60
+expiry_heap = []
+expiry_wakeup = asyncio.Event()
 
+def schedule_expiry(store, key, end_time):
+    heapq.heappush(expiry_heap, (end_time, store, key))
+    if expiry_heap[0][0] == end_time:
+        expiry_wakeup.set()
+
+def schedule_loaded_expiries():
+    expiry_heap.clear()
     for key, mute_data in active_mutes.items():
-        if mute_data['end_time'] <= now:
-            guild_id, user_id = key.split('-')
-            try:
-                guild = bot.get_guild(int(guild_id))
-                if guild:
-                    member = await guild.fetch_member(int(user_id))
-                    if member and member.is_timed_out():
-                        await member.timeout(None)
-            except Exception as e:
-                print(f'Error unmuting user: {e}')
-            to_remove.append(key)
-
-    for key in to_remove:
+        expiry_heap.append((mute_data['end_time'], 'mutes', key))
+    for guild_id, user_id, protection_data in protections.items():
+        if not protection_data.infinite:
+            expiry_heap.append((protection_data.end_time, 'protections', (guild_id, user_id)))
+    for key, penalty_data in command_penalties.items():
+        if penalty_data.get('type') == 'mute':
+            expiry_heap.append((penalty_data.get('end_time', 0), 'command_penalties', key))
+    for giveaway_id, giveaway_data in giveaways.items():
+        if not giveaway_data.get('ended', False):
+            expiry_heap.append((giveaway_data['end_time'], 'giveaways', giveaway_id))
+    heapq.heapify(expiry_heap)
+    expiry_wakeup.set()
+
+async def expire_mute(key, now):
+    mute_data = active_mutes.get(key)
+    if not mute_data or mute_data['end_time'] > now:
+        return
+
+    guild_id, user_id = key.split('-')
+    try:
+        guild = bot.get_guild(int(guild_id))
+        if guild:
+            member = await guild.fetch_member(int(user_id))
+            if member and member.is_timed_out():
+                await member.timeout(None)
+    except Exception as e:
+        print(f'Error unmuting user: {e}')
+
+    # The user may have been muted again while we were unmuting
+    if active_mutes.get(key) is mute_data:
         del active_mutes[key]
+        save_data('mutes', key)
 
-    if to_remove:
-        save_data()
+async def expire_protection(member, now):
+    guild_id, user_id = member
+    protection_data = protections.get(guild_id, user_id)
+    if not protection_data or protection_data.is_active(now):
+        return
+    protections.pop(guild_id, user_id)
+    save_data('protections', f'{guild_id}-{user_id}')
 
-@tasks.loop(seconds=30)
-async def check_protections():
-    now = datetime.now().timestamp()
-    to_remove = []
+async def expire_command_penalty(key, now):
+    penalty_data = command_penalties.get(key)
+    if not penalty_data or penalty_data.get('type') != 'mute' or penalty_data.get('end_time', 0) > now:
+        return
+    del command_penalties[key]
+    save_data('command_penalties', key)
+
+# Giveaways created with the entry button are marked 'entry_button' and
+# keep their entrants in giveaway_entrants; an entry only appends to the
+# giveaway's entrant file and leaves the record alone. Older giveaways are
+# still entered by reacting with 🎉 and are read from the reactions.
+def enter_giveaway(giveaway_id, user_id):
+    if not giveaway_entrants.add(giveaway_id, user_id):
+        return False
+    save_data('giveaway_entrants', giveaway_id)
+    return True
 
-    for key, protection_data in protections.items():
-        # Skip infinite protections
-        if protection_data.get('infinite', False):
-            continue
+def import_giveaway_entrants():
+    # Button giveaways used to keep an 'entrants' list in their record
+    converted = []
+    for giveaway_id, giveaway_data in giveaways.items():
+        if 'entrants' in giveaway_data:
+            giveaway_entrants.import_list(giveaway_id, giveaway_data.pop('entrants'))
+            giveaway_data['entry_button'] = True
+            converted.append(giveaway_id)
+    if converted:
+        save_data('giveaway_entrants', *converted)
+        save_data('giveaways', *converted)
+
+async def fetch_reaction_entrants(message):
+    reaction = discord.utils.get(message.reactions, emoji='🎉')
+    if not reaction:
+        return []
+    return [user.id async for user in reaction.users() if not user.bot]
+
+def draw_winners(entrants, count, exclude=(), weights=None):
+    exclude = set(exclude)
+    if weights is not None:
+        return weighted_sample(entrants, weights, count, exclude)
+
+    # Rejection sampling from the entrant list: O(count) expected picks as
+    # long as most entrants are still eligible
+    if count > (len(entrants) - len(exclude)) // 2:
+        eligible = [user_id for user_id in entrants if user_id not in exclude]
+        return random.sample(eligible, min(count, len(eligible)))
+
+    winners = []
+    while len(winners) < count:
+        user_id = entrants[random.randrange(len(entrants))]
+        if user_id not in exclude:
+            exclude.add(user_id)
+            winners.append(user_id)
+    return winners
+
+GIVEAWAY_ROLE_WEIGHT = re.compile(r'<@&(\d+)>\s*[=:x]\s*(\d+(?:\.\d+)?)')
+
+def parse_role_weights(text):
+    # '@VIP=3 @Booster=2' (role mentions) -> {'role_id': 3.0, ...}
+    return {role_id: float(multiplier) for role_id, multiplier in GIVEAWAY_ROLE_WEIGHT.findall(text or '')}
+
+def giveaway_weights(giveaway_data, entrants):
+    # Entry weights for a weighted giveaway, or None for an even draw
+    weighting = giveaway_data.get('weighting', 'none')
+    guild_id = int(giveaway_data['guild_id'])
+    if weighting == 'level':
+        # Level 0 members still get one entry
+        return [get_level_from_xp(get_user_xp(guild_id, user_id))['level'] + 1 for user_id in entrants]
+
+    if weighting == 'coins':
+        default_coins = Balance().coins
+        weights = []
+        for user_id in entrants:
+            balance = gambling_data.get(guild_id, user_id)
+            weights.append(max(balance.coins if balance else default_coins, 1))
+        return weights
+
+    if weighting == 'roles':
+        guild = bot.get_guild(guild_id)
+        multipliers = {int(role_id): multiplier for role_id, multiplier in giveaway_data.get('role_weights', {}).items()}
+        weights = []
+        for user_id in entrants:
+            member = guild.get_member(user_id) if guild else None
+            roles = member.roles if member else []
+            weights.append(max((multipliers[role.id] for role in roles if role.id in multipliers), default=1))
+        return weights
 
-        if protection_data['end_time'] <= now:
-            to_remove.append(key)
+    return None
 
-    for key in to_remove:
-        del protections[key]
+async def finish_giveaway(giveaway_id, channel, footer, persist=True):
+    # Draws and announces the winners. Returns their IDs, or None when the
+    # giveaway message no longer exists. With persist=False the caller
+    # saves the giveaway.
+    giveaway_data = giveaways[giveaway_id]
+    if giveaway_data.get('entry_button'):
+        message = channel.get_partial_message(int(giveaway_id))
+        entrants = giveaway_entrants.get(giveaway_id)
+    else:
+        try:
+            message = await channel.fetch_message(int(giveaway_id))
+        except discord.NotFound:
+            del giveaways[giveaway_id]
+            if persist:
+                save_data('giveaways', giveaway_id)
+            return None
+        entrants = await fetch_reaction_entrants(message)
+
+    giveaway_data['ended'] = True
+    winners = draw_winners(entrants, giveaway_data['winners'], weights=giveaway_weights(giveaway_data, entrants))
+    giveaway_entrants.drop(giveaway_id)
+    giveaway_data['winners_list'] = [str(user_id) for user_id in winners]
+    if persist:
+        save_data('giveaways', giveaway_id)
 
-    if to_remove:
-        save_data()
+    embed = discord.Embed(
+        title='🎉 Giveaway Ended!',
+        description=f'**Prize:** {giveaway_data["prize"]}',
+        color=0x00FF00
+    )
+    winner_mentions = ', '.join(f'<@{user_id}>' for user_id in winners)
+    embed.add_field(name='Winners', value=winner_mentions or 'No participants', inline=False)
+    embed.set_footer(text=footer)
+    embed.timestamp = datetime.utcnow()
 
-@tasks.loop(seconds=30)
-async def check_command_penalties():
-    now = datetime.now().timestamp()
-    to_remove = []
+    try:
+        await message.edit(embed=embed, view=None)
+    except discord.NotFound:
+        pass
 
-    for user_id, penalty_data in command_penalties.items():
-        if penalty_data.get('type') == 'mute' and penalty_data.get('end_time', 0) <= now:
-            to_remove.append(user_id)
+    if winners:
+        await channel.send(f'🎊 Congratulations {winner_mentions}! You won **{giveaway_data["prize"]}**!')
+    else:
+        await channel.send(f'❌ Giveaway for **{giveaway_data["prize"]}** ended with no participants!')
+    return winners
 
-    for user_id in to_remove:
-        del command_penalties[user_id]
+async def expire_giveaway(giveaway_id, now):
+    giveaway_data = giveaways.get(giveaway_id)
+    if not giveaway_data or giveaway_data.get('ended', False) or giveaway_data['end_time'] > now:
+        return
+    queue_giveaway_finalization(int(giveaway_data['guild_id']), giveaway_id)
+
+# Due giveaways are finalized as concurrent tasks, at most
+# GIVEAWAY_CONCURRENCY at a time, taking guilds in turn so a guild with many
+# giveaways ending together (or a slow channel) does not hold up the others.
+# A guild only gets more than one slot when no other guild is waiting. A
+# slot is refilled as soon as its task finishes, and the finalize_giveaways
+# loop saves finished giveaways once per tick. Giveaways that ended while
+# the bot was offline come due as soon as the expiry scheduler starts.
+GIVEAWAY_CONCURRENCY = int(os.getenv('GIVEAWAY_CONCURRENCY', '5'))
+# Guild ID -> giveaway IDs waiting to be finalized, guilds in turn order
+due_giveaways = OrderedDict()
+queued_giveaways = set()
+giveaway_tasks = set()
+# Guild ID -> number of its giveaways being finalized
+finalizing_guilds = Counter()
+finished_giveaways = set()
+
+def queue_giveaway_finalization(guild_id, giveaway_id):
+    if giveaway_id in queued_giveaways:
+        return
+    queued_giveaways.add(giveaway_id)
+    due_giveaways.setdefault(guild_id, deque()).append(giveaway_id)
+    dispatch_giveaways()
+
+def dispatch_giveaways():
+    while due_giveaways and len(giveaway_tasks) < GIVEAWAY_CONCURRENCY:
+        # The first waiting guild with nothing in progress, else the next
+        # guild in turn
+        guild_id = next((g for g in due_giveaways if not finalizing_guilds[g]), None)
+        if guild_id is None:
+            guild_id = next(iter(due_giveaways))
+
+        queue = due_giveaways.pop(guild_id)
+        giveaway_id = queue.popleft()
+        if queue:
+            # Back of the line until the other guilds have had a turn
+            due_giveaways[guild_id] = queue
+
+        finalizing_guilds[guild_id] += 1
+        task = asyncio.create_task(finalize_giveaway(guild_id, giveaway_id))
+        giveaway_tasks.add(task)
+        task.add_done_callback(lambda task, guild_id=guild_id: giveaway_task_done(task, guild_id))
+
+def giveaway_task_done(task, guild_id):
+    giveaway_tasks.discard(task)
+    finalizing_guilds[guild_id] -= 1
+    if not finalizing_guilds[guild_id]:
+        del finalizing_guilds[guild_id]
+    dispatch_giveaways()
+
+async def finalize_giveaway(guild_id, giveaway_id):
+    try:
+        # It may have been ended with /giveaway end while it was queued
+        giveaway_data = giveaways.get(giveaway_id)
+        if not giveaway_data or giveaway_data.get('ended', False):
+            return
 
-    if to_remove:
-        save_data()
+        guild = bot.get_guild(guild_id)
+        channel = guild.get_channel(int(giveaway_data['channel_id'])) if guild else None
+        if not channel or not isinstance(channel, (discord.TextChannel, discord.Thread)):
+            # The guild or channel may only be unavailable for now
+            schedule_expiry('giveaways', giveaway_id, datetime.now().timestamp() + EXPIRY_RETRY_DELAY)
+            return
+
+        await finish_giveaway(giveaway_id, channel, 'Ended at', persist=False)
+    except Exception as e:
+        print(f'Error ending giveaway {giveaway_id}: {e}')
+    finally:
+        finished_giveaways.add(giveaway_id)
+        queued_giveaways.discard(giveaway_id)
+
+def persist_finished_giveaways():
+    if finished_giveaways:
+        save_data('giveaways', *finished_giveaways)
+        finished_giveaways.clear()
+
+@tasks.loop(seconds=1)
+async def finalize_giveaways():
+    persist_finished_giveaways()
+    dispatch_giveaways()
+
+EXPIRY_HANDLERS = {
+    'mutes': expire_mute,
+    'protections': expire_protection,
+    'command_penalties': expire_command_penalty,
+    'giveaways': expire_giveaway
+}
+
+@tasks.loop()
+async def expire_records():
+    expiry_wakeup.clear()
+    delay = expiry_heap[0][0] - datetime.now().timestamp() if expiry_heap else None
+    if delay is None or delay > 0:
+        try:
+            await asyncio.wait_for(expiry_wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
 
-@tasks.loop(seconds=10)
-async def check_giveaways():
     now = datetime.now().timestamp()
-    to_remove = []
+    while expiry_heap and expiry_heap[0][0] <= now:
+        _, store, key = heapq.heappop(expiry_heap)
+        try:
+            await EXPIRY_HANDLERS[store](key, now)
+        except Exception as e:
+            print(f'Error expiring {store} {key}: {e}')
+
+# DM outbox: notices to users are queued and sent by background workers so
+# commands can respond straight away. Rate limits and server errors are
+# retried with backoff; users with closed DMs are dropped without retrying.
+DM_QUEUE_SIZE = int(os.getenv('DM_QUEUE_SIZE', '1000'))
+DM_WORKERS = int(os.getenv('DM_WORKERS', '3'))
+DM_MAX_ATTEMPTS = 4
+DM_RETRY_DELAY = 2
+# Ban and kick remove the shared server a DM needs, so their notice gets
+# this long to go out before the action is taken. Kept well under the 3s
+# Discord gives an interaction to respond.
+DM_BEFORE_ACTION_TIMEOUT = 1
+dm_queue = asyncio.Queue(maxsize=DM_QUEUE_SIZE)
+dm_workers = []
+dm_stats = Counter()
+
+def queue_dm(user, content):
+    # Returns a future that resolves to whether the DM was delivered
+    future = asyncio.get_running_loop().create_future()
+    try:
+        dm_queue.put_nowait((user, content, time.monotonic(), future))
+        dm_stats['queued'] += 1
+    except asyncio.QueueFull:
+        dm_stats['dropped_full'] += 1
+        future.set_result(False)
+    return future
+
+async def send_dm_before_action(user, content):
+    try:
+        await asyncio.wait_for(asyncio.shield(queue_dm(user, content)), DM_BEFORE_ACTION_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
 
-    for giveaway_id, giveaway_data in list(giveaways.items()):
-        if giveaway_data['end_time'] <= now and not giveaway_data.get('ended', False):
-            try:
-                guild = bot.get_guild(int(giveaway_data['guild_id']))
-                if not guild:
-                    continue
-
-                channel = guild.get_channel(int(giveaway_data['channel_id']))
-                if not channel or not isinstance(channel, (discord.TextChannel, discord.Thread)):
-                    continue
-
-                try:
-                    message = await channel.fetch_message(int(giveaway_id))
-                except:
-                    to_remove.append(giveaway_id)
-                    continue
-
-                # Get all users who reacted with 🎉
-                reaction = discord.utils.get(message.reactions, emoji='🎉')
-                if not reaction:
-                    giveaways[giveaway_id]['ended'] = True
-                    save_data()
-                    await channel.send(f'❌ Giveaway for **{giveaway_data["prize"]}** ended with no participants!')
-                    continue
-
-                participants = []
-                async for user in reaction.users():
-                    if not user.bot:
-                        participants.append(user)
-
-                if len(participants) == 0:
-                    giveaways[giveaway_id]['ended'] = True
-                    save_data()
-                    await channel.send(f'❌ Giveaway for **{giveaway_data["prize"]}** ended with no valid participants!')
-                    continue
-
-                num_winners = min(giveaway_data['winners'], len(participants))
-                winners = random.sample(participants, num_winners)
-
-                winner_mentions = ', '.join([winner.mention for winner in winners])
-
-                embed = discord.Embed(
-                    title='🎉 Giveaway Ended!',
-                    description=f'**Prize:** {giveaway_data["prize"]}',
-                    color=0x00FF00
-                )
-                embed.add_field(name='Winners', value=winner_mentions, inline=False)
-                embed.set_footer(text=f'Ended at')
-                embed.timestamp = datetime.utcnow()
-
-                await message.edit(embed=embed)
-                await channel.send(f'🎊 Congratulations {winner_mentions}! You won **{giveaway_data["prize"]}**!')
-
-                giveaways[giveaway_id]['ended'] = True
-                giveaways[giveaway_id]['winners_list'] = [str(w.id) for w in winners]
-                save_data()
-
-            except Exception as e:
-                print(f'Error ending giveaway {giveaway_id}: {e}')
-
-    for giveaway_id in to_remove:
-        if giveaway_id in giveaways:
-            del giveaways[giveaway_id]
+async def deliver_dm(user, content):
+    for attempt in range(DM_MAX_ATTEMPTS):
+        try:
+            await user.send(content)
+            return True
+        except discord.Forbidden:
+            dm_stats['dropped_closed'] += 1
+            return False
+        except discord.HTTPException as e:
+            if e.status != 429 and e.status < 500:
+                break
+            if attempt + 1 < DM_MAX_ATTEMPTS:
+                dm_stats['retried'] += 1
+                await asyncio.sleep(DM_RETRY_DELAY * 2 ** attempt)
+        except Exception as e:
+            print(f'Could not send DM to {user.id}: {e}')
+            break
+
+    dm_stats['failed'] += 1
+    return False
+
+async def dm_worker():
+    while True:
+        user, content, queued_at, future = await dm_queue.get()
+        delivered = False
+        try:
+            delivered = await deliver_dm(user, content)
+            if delivered:
+                dm_stats['sent'] += 1
+                dm_stats['delivery_ms'] += int((time.monotonic() - queued_at) * 1000)
+        finally:
+            if not future.done():
+                future.set_result(delivered)
+            dm_queue.task_done()
+
+def start_dm_workers():
+    if dm_workers:
+        return
+    for _ in range(DM_WORKERS):
+        dm_workers.append(asyncio.create_task(dm_worker()))
+
+@tasks.loop(seconds=XP_COMMIT_INTERVAL)
+async def commit_xp():
+    commit_pending_xp()
+
+    # Cooldowns that have run out are the same as no entry
+    now = time.monotonic()
+    for state in guild_states.values():
+        if state.cooldowns:
+            for user_id in [u for u, at in state.cooldowns.items() if now - at >= XP_COOLDOWN]:
+                del state.cooldowns[user_id]
+
+@tasks.loop(seconds=60)
+async def evict_guilds():
+    # Unsaved changes are written back before their guild is dropped
+    commit_pending_xp()
+    if dirty_stores:
+        await flush_dirty_stores()
+
+    for name in ('levels', 'warns', 'gambling'):
+        store = STORES[name]()
+        if not isinstance(store, PartitionedStore):
+            continue
+        # Changes made while the flush ran keep their guild loaded
+        keys = dirty_stores.get(name, set())
+        if keys is None:
+            continue
+        keep = {int(key.split('-')[0]) for key in keys}
+        store.evict(GUILD_IDLE_SECONDS, MAX_LOADED_GUILDS, keep)
+
+@tasks.loop(seconds=1)
+async def flush_data():
+    if not dirty_stores:
+        return
+
+    now = time.monotonic()
+    if (pending_saves < SAVE_MAX_PENDING and
+            now - last_dirty_at < SAVE_INTERVAL and
+            now - first_dirty_at < SAVE_MAX_AGE):
+        return
+
+    await flush_dirty_stores()
+
+# FAST_BOOT skips the slash command sync when the command tree hashes the
+# same as at the last successful sync. Set FAST_BOOT=0 to always sync.
+FAST_BOOT = os.getenv('FAST_BOOT', '1') != '0'
+COMMAND_HASH_PATH = DATA_DIR / 'command_tree.hash'
+commands_synced = False
+
+# Phase name -> seconds, printed once the bot is first ready
+startup_phases = {}
+startup_mark = BOOT_STARTED
+
+def mark_startup_phase(name):
+    global startup_mark
+    now = time.perf_counter()
+    startup_phases[name] = now - startup_mark
+    startup_mark = now
+
+def format_startup_phases():
+    phases = ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in startup_phases.items())
+    return f'Startup took {sum(startup_phases.values()):.2f}s ({phases})'
+
+def command_tree_hash():
+    commands = sorted((command.to_dict() for command in bot.tree.get_commands()), key=lambda c: (c.get('type', 1), c['name']))
+    payload = json.dumps({'application_id': bot.application_id, 'commands': commands}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def sync_commands():
+    tree_hash = command_tree_hash()
+    if FAST_BOOT and COMMAND_HASH_PATH.exists() and COMMAND_HASH_PATH.read_text().strip() == tree_hash:
+        print('Slash commands unchanged since the last sync, skipping')
+        return
 
-    if to_remove:
-        save_data()
+    synced = await bot.tree.sync()
+    COMMAND_HASH_PATH.write_text(tree_hash)
+    print(f'Synced {len(synced)} slash commands')
+
+def start_loop(loop):
+    # on_ready fires again after every reconnect
+    if not loop.is_running():
+        loop.start()
+
+async def setup_hook():
+    mark_startup_phase('login')
+    # Entry buttons on giveaway messages keep working across restarts
+    bot.add_view(GiveawayEntryView())
+
+bot.setup_hook = setup_hook
 
 @bot.event
 async def on_ready():
+    global commands_synced
     print(f'Bot logged in as {bot.user.name}')
     print(f'Bot Owner: {config["bot_owner"] or "Not set - first user to use /setbotowner will become the bot owner"}')
 
+    first_ready = 'ready' not in startup_phases
+    if first_ready:
+        mark_startup_phase('ready')
+    if not commands_synced:
+        try:
+            await sync_commands()
+            commands_synced = True
+        except Exception as e:
+            print(f'Failed to sync commands: {e}')
+        if first_ready:
+            mark_startup_phase('sync')
+
+    start_loop(expire_records)
+    start_dm_workers()
+    start_loop(commit_xp)
+    start_loop(finalize_giveaways)
+    if WRITE_BEHIND:
+        start_loop(flush_data)
+    if LAZY_GUILDS:
+        start_loop(evict_guilds)
+
+    if first_ready:
+        print(format_startup_phases())
+
+# Raid detection: every guild keeps a sliding window of recent joins. A
+# raid is flagged when RAID_JOIN_THRESHOLD joins, or RAID_NEW_ACCOUNT_THRESHOLD
+# joins from accounts younger than RAID_NEW_ACCOUNT_AGE, land within
+# RAID_WINDOW seconds. Raid mode lasts until RAID_COOLDOWN seconds pass
+# without another flagged join. What happens during a raid is set per guild
+# with /raidprotection.
+RAID_WINDOW = float(os.getenv('RAID_WINDOW', '10'))
+RAID_JOIN_THRESHOLD = int(os.getenv('RAID_JOIN_THRESHOLD', '10'))
+RAID_NEW_ACCOUNT_THRESHOLD = int(os.getenv('RAID_NEW_ACCOUNT_THRESHOLD', '5'))
+RAID_NEW_ACCOUNT_AGE = float(os.getenv('RAID_NEW_ACCOUNT_AGE', str(7 * 24 * 3600)))
+RAID_COOLDOWN = float(os.getenv('RAID_COOLDOWN', '300'))
+
+# (upper bound in seconds, label) for the account ages in raid alerts
+ACCOUNT_AGE_BUCKETS = ((3600, 'under 1 hour'), (24 * 3600, 'under 1 day'), (RAID_NEW_ACCOUNT_AGE, 'new'), (float('inf'), 'older'))
+
+DEFAULT_RAID_PROTECTION = {'pause_welcome_dms': True, 'timeout': 0, 'alert_channel': None}
+
+class RaidDetector:
+    __slots__ = ('joins', 'bucket_counts', 'raid_until')
+
+    def __init__(self):
+        # (monotonic join time, age bucket, user ID) for the joins inside
+        # the window
+        self.joins = deque()
+        self.bucket_counts = [0] * len(ACCOUNT_AGE_BUCKETS)
+        self.raid_until = 0.0
+
+    def new_accounts(self):
+        return sum(self.bucket_counts[:-1])
+
+    def record_join(self, now, user_id, account_age):
+        # Returns whether this join started a raid. Each join is appended
+        # and expired once, so the cost per join is O(1) amortized.
+        bucket = next(i for i, (limit, _) in enumerate(ACCOUNT_AGE_BUCKETS) if account_age < limit)
+        self.joins.append((now, bucket, user_id))
+        self.bucket_counts[bucket] += 1
+        while now - self.joins[0][0] > RAID_WINDOW:
+            _, old_bucket, _ = self.joins.popleft()
+            self.bucket_counts[old_bucket] -= 1
+
+        was_raid = self.in_raid(now)
+        if len(self.joins) >= RAID_JOIN_THRESHOLD or self.new_accounts() >= RAID_NEW_ACCOUNT_THRESHOLD:
+            self.raid_until = now + RAID_COOLDOWN
+        return not was_raid and self.in_raid(now)
+
+    def in_raid(self, now):
+        return now < self.raid_until
+
+    def recent_user_ids(self):
+        return [user_id for _, _, user_id in self.joins]
+
+    def describe(self):
+        ages = ', '.join(f'{label}: {count}' for (_, label), count in zip(ACCOUNT_AGE_BUCKETS, self.bucket_counts) if count)
+        return f'{len(self.joins)} joins in the last {RAID_WINDOW:g}s ({ages})'
+
+raid_detectors = {}
+
+def get_raid_protection(guild_id):
+    return {**DEFAULT_RAID_PROTECTION, **config['raid_protection'].get(str(guild_id), {})}
+
+async def timeout_raid_join(member, seconds):
     try:
-        synced = await bot.tree.sync()
-        print(f'Synced {len(synced)} slash commands')
-    except Exception as e:
-        print(f'Failed to sync commands: {e}')
+        await member.timeout(discord.utils.utcnow() + timedelta(seconds=seconds), reason='Raid protection')
+    except discord.HTTPException as e:
+        print(f'Could not timeout {member.id} during raid: {e}')
+        return
 
-    check_mutes.start()
-    check_protections.start()
-    check_command_penalties.start()
-    check_giveaways.start()
+    key = f'{member.guild.id}-{member.id}'
+    active_mutes[key] = {
+        'end_time': (datetime.now() + timedelta(seconds=seconds)).timestamp(),
+        'reason': 'Raid protection'
+    }
+    schedule_expiry('mutes', key, active_mutes[key]['end_time'])
+    save_data('mutes', key)
+
+async def send_raid_alert(guild, channel_id, detector, settings):
+    channel = guild.get_channel(int(channel_id))
+    if not channel:
+        return
+
+    responses = []
+    if settings['pause_welcome_dms']:
+        responses.append('welcome DMs paused')
+    if settings['timeout']:
+        responses.append(f'new joins timed out for {format_duration(settings["timeout"])}')
+    try:
+        await channel.send(
+            f'🚨 **Possible raid detected**\n'
+            f'{detector.describe()}\n'
+            f'Response: {", ".join(responses) or "alert only"}. '
+            f'Raid mode ends after {format_duration(int(RAID_COOLDOWN))} without suspicious joins.\n'
+            f'Use `/massban joined_within:` to remove the accounts that joined during the raid.'
+        )
+    except discord.HTTPException as e:
+        print(f'Could not send raid alert: {e}')
 
 @bot.event
 async def on_member_join(member):
-    if config['welcome_dm'].get(str(member.guild.id), False):
-        try:
-            await member.send(f'Hey there! Welcome to {member.guild.name}!')
-        except Exception as e:
-            print(f'Could not send welcome DM: {e}')
+    guild = member.guild
+    detector = raid_detectors.get(guild.id)
+    if detector is None:
+        detector = raid_detectors[guild.id] = RaidDetector()
+
+    now = time.monotonic()
+    account_age = (discord.utils.utcnow() - member.created_at).total_seconds()
+    raid_started = detector.record_join(now, member.id, account_age)
+
+    if detector.in_raid(now):
+        settings = get_raid_protection(guild.id)
+        if raid_started and settings['alert_channel']:
+            await send_raid_alert(guild, settings['alert_channel'], detector, settings)
+        if settings['timeout']:
+            # The joins that made up the burst are timed out along with
+            # the one that tipped it over
+            targets = [guild.get_member(user_id) for user_id in detector.recent_user_ids()] if raid_started else [member]
+            await asyncio.gather(*(timeout_raid_join(target, settings['timeout']) for target in targets if target))
+        if settings['pause_welcome_dms']:
+            return
+
+    if config['welcome_dm'].get(str(guild.id), False):
+        queue_dm(member, f'Hey there! Welcome to {guild.name}!')
 
 @bot.event
 async def on_message(message):
     if message.author.bot or not message.guild:
         return
 
+    guild_id = message.guild.id
+    user_id = message.author.id
+    state = get_guild_state(guild_id)
+
     # Check if user is AFK and returning
-    user_key = f'{message.guild.id}-{message.author.id}'
-    if user_key in afk_users:
-        afk_data = afk_users[user_key]
-        del afk_users[user_key]
-        save_data()
+    if user_id in state.afk:
+        clear_afk(guild_id, user_id)
         await message.channel.send(f'{message.author.mention} is back! Welcome back :)')
 
     # Check if message mentions AFK users
-    for mention in message.mentions:
-        mention_key = f'{message.guild.id}-{mention.id}'
-        if mention_key in afk_users:
-            afk_data = afk_users[mention_key]
-            afk_time = datetime.now().timestamp() - afk_data['timestamp']
-            time_str = format_duration(int(afk_time))
-            await message.channel.send(f'{mention.mention} is AFK: {afk_data["reason"]} - {time_str} ago')
+    if state.afk:
+        for mention in message.mentions:
+            afk_data = state.afk.get(mention.id)
+            if afk_data:
+                afk_time = datetime.now().timestamp() - afk_data['timestamp']
+                time_str = format_duration(int(afk_time))
+                await message.channel.send(f'{mention.mention} is AFK: {afk_data["reason"]} - {time_str} ago')
 
-    new_level = add_xp(message.guild.id, message.author.id)
+    new_level = add_xp(guild_id, user_id, state)
 
     # Send level-up notification (check if channel is blacklisted)
     if new_level is not None:
-        guild_blacklist = level_blacklist.get(str(message.guild.id), [])
-        if str(message.channel.id) not in guild_blacklist:
+        if message.channel.id not in state.level_blacklist:
             # Bot owner shows infinity level instead of actual level
             if is_bot_owner(message.author.id):
                 await message.channel.send(f'🎉 {message.author.mention} has leveled up to **Level ∞**!')
             else:
                 await message.channel.send(f'🎉 {message.author.mention} has leveled up to **Level {new_level}**!')
 
-    prefix = get_prefix(message.guild.id)
+    prefix = state.prefix
 
     if message.content.startswith(prefix):
         ctx = await bot.get_context(message)
@@ -632,7 +1631,7 @@ async def setbotowner(interaction: discord.Interaction):
         return await interaction.response.send_message('Bot owner has already been set!', ephemeral=True)
 
     config['bot_owner'] = str(interaction.user.id)
-    save_data()
+    save_data('config')
     await interaction.response.send_message(f'✅ {interaction.user.mention} is now the bot owner!')
 
 @bot.tree.command(name='help', description='Show all available commands')
@@ -654,7 +1653,8 @@ async def help_command(interaction: discord.Interaction):
     embed.add_field(
         name='**Leveling System**',
         value='/levelstats - View your level and progress\n'
-              '/levelboard - View top 10 users by level\n'
+              '/levelboard [page] - View the level leaderboard\n'
+              '/rank [user] - View leaderboard position\n'
               '/addlevels <user> <amount> or ?addlevels <@user> <amount> - Add levels to a user (Admin+)\n'
               '/removelevels <user> <amount> or ?removelevels <@user> <amount> - Remove levels from a user (Admin+)',
         inline=False
@@ -667,6 +1667,9 @@ async def help_command(interaction: discord.Interaction):
               '/ban <user> [reason] - Ban user\n'
               '/unban <user_id> - Unban user by ID\n'
               '/kick <user> [reason] - Kick user\n'
+              '/massban [targets] [joined_within] [reason] - Ban many accounts\n'
+              '/masskick [targets] [joined_within] [reason] - Kick many members\n'
+              '/masstimeout <duration> [targets] [joined_within] [reason] - Timeout many members\n'
               '/warn <user> <reason> - Warn user\n'
               '/viewwarns <user> - View user warnings\n'
               '/delwarn <user> <warn_id> - Delete a warning\n'
@@ -680,7 +1683,8 @@ async def help_command(interaction: discord.Interaction):
               '/commandunban <user> - Unban from commands\n'
               '/commandmute <user> <duration> [reason] - Mute from commands\n'
               '/commandunmute <user> - Unmute from commands\n'
-              '/commandwarn <user> [reason] - Warn about command usage',
+              '/commandwarn <user> [reason] - Warn about command usage\n'
+              '/perfstats - View performance stats',
         inline=False
     )
 
@@ -718,7 +1722,9 @@ async def help_command(interaction: discord.Interaction):
               '/roulette <amount> <bet> - Roulette betting game\n'
               '/shop - View the shop\n'
               '/buy <item> - Buy an item from the shop\n'
-              '/daily - Claim your daily coins',
+              '/daily - Claim your daily coins\n'
+              '/economy - Server coin total and richest members\n'
+              '/resetstats <levels|economy> - Reset the server\'s XP or coins (Owner+)',
         inline=False
     )
 
@@ -727,13 +1733,14 @@ async def help_command(interaction: discord.Interaction):
         value='/poll <question> <options> - Create a poll\n'
               '/afk [reason] - Set yourself as AFK\n'
               '/addit - Toggle welcome DM system (Admin+)\n'
+              '/raidprotection [pause_welcome_dms] [timeout] [alert_channel] - Raid response (Admin+)\n'
               '/beta - Display bot beta status',
         inline=False
     )
 
     embed.add_field(
         name='**Giveaway Commands (Admin+)**',
-        value='/giveaway create <duration> <winners> <prize> <channel> - Create a giveaway\n'
+        value='/giveaway create <duration> <winners> <prize> <channel> [weighting] [role_weights] - Create a giveaway\n'
               '/giveaway end <message_id> - End a giveaway early\n'
               '/giveaway reroll <message_id> - Reroll giveaway winners\n'
               '/giveaway list - List active giveaways',
@@ -761,7 +1768,8 @@ async def newprefix(interaction: discord.Interaction, new_prefix: str):
         return await interaction.response.send_message('You need to be an admin to use this command.', ephemeral=True)
 
     config['prefixes'][str(interaction.guild.id)] = new_prefix
-    save_data()
+    refresh_guild_settings(interaction.guild.id)
+    save_data('config')
     await interaction.response.send_message(f'✅ Prefix changed to `{new_prefix}`')
 
 @bot.tree.command(name='addowner', description='Add server owner (Bot Owner only)')
@@ -780,7 +1788,7 @@ async def addowner(interaction: discord.Interaction, user: discord.Member):
 
     if user_id not in config['owners'][guild_id]:
         config['owners'][guild_id].append(user_id)
-        save_data()
+        save_data('config')
         await interaction.response.send_message(f'✅ {user.name} has been added as an owner.')
     else:
         await interaction.response.send_message(f'{user.name} is already an owner.', ephemeral=True)
@@ -801,7 +1809,7 @@ async def addadmin(interaction: discord.Interaction, user: discord.Member):
 
     if user_id not in config['admins'][guild_id]:
         config['admins'][guild_id].append(user_id)
-        save_data()
+        save_data('config')
         await interaction.response.send_message(f'✅ {user.name} has been added as an admin.')
     else:
         await interaction.response.send_message(f'{user.name} is already an admin.', ephemeral=True)
@@ -819,7 +1827,7 @@ async def removeadmin(interaction: discord.Interaction, user: discord.Member):
 
     if guild_id in config['admins'] and user_id in config['admins'][guild_id]:
         config['admins'][guild_id].remove(user_id)
-        save_data()
+        save_data('config')
         await interaction.response.send_message(f'✅ {user.name} has been removed as an admin.')
     else:
         await interaction.response.send_message(f'{user.name} is not an admin.', ephemeral=True)
@@ -837,7 +1845,7 @@ async def removeowner(interaction: discord.Interaction, user: discord.Member):
 
     if guild_id in config['owners'] and user_id in config['owners'][guild_id]:
         config['owners'][guild_id].remove(user_id)
-        save_data()
+        save_data('config')
         await interaction.response.send_message(f'✅ {user.name} has been removed as an owner.')
     else:
         await interaction.response.send_message(f'{user.name} is not an owner.', ephemeral=True)
@@ -858,67 +1866,56 @@ async def levelstats(interaction: discord.Interaction):
         )
         return
 
-    key = f'{interaction.guild.id}-{interaction.user.id}'
-    user_data = levels.get(key, {'xp': 0})
-    level_data = get_level_from_xp(user_data['xp'])
+    xp = get_user_xp(interaction.guild.id, interaction.user.id)
+    level_data = get_level_from_xp(xp)
 
     await interaction.response.send_message(
         f'📊 **Your Level Stats**{badge_text}\n'
         f'Level: **{level_data["level"]}**\n'
-        f'Total Messages: **{user_data["xp"]}**\n'
+        f'Total Messages: **{xp}**\n'
         f'Progress: **{level_data["messages_in_level"]}/{level_data["messages_needed"]}** messages to next level'
     )
 
-@bot.tree.command(name='levelboard', description='View top 10 users by level')
-async def levelboard(interaction: discord.Interaction):
+@bot.tree.command(name='levelboard', description='View the level leaderboard')
+@app_commands.describe(page='Page number to start on')
+async def levelboard(interaction: discord.Interaction, page: int = 1):
     if not interaction.guild:
         return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
-    guild_levels = []
 
-    for key, data in levels.items():
-        if key.startswith(str(interaction.guild.id)):
-            user_id = key.split('-')[1]
-            level_data = get_level_from_xp(data['xp'])
-            guild_levels.append({
-                'user_id': user_id,
-                'level': level_data['level'],
-                'xp': data['xp']
-            })
+    content, page, pages = await build_levelboard_page(interaction.guild, page - 1)
+    if pages == 1:
+        return await interaction.response.send_message(content)
 
-    guild_levels.sort(key=lambda x: x['xp'], reverse=True)
-    guild_levels = guild_levels[:10]
+    view = LevelboardView(interaction.guild, interaction.user.id, page, pages)
+    await interaction.response.send_message(content, view=view)
+    view.message = await interaction.original_response()
 
-    leaderboard = '🏆 **Level Leaderboard**\n\n'
+@bot.tree.command(name='rank', description='View your position on the level leaderboard')
+@app_commands.describe(member='The member to check (defaults to you)')
+async def rank(interaction: discord.Interaction, member: discord.Member = None):
+    if not interaction.guild:
+        return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
+    member = member or interaction.user
 
-    if config['bot_owner']:
-        try:
-            bot_owner = await bot.fetch_user(int(config['bot_owner']))
-            badge = get_user_badge(interaction.guild.id, config['bot_owner'])
-            badge_text = f' {badge}' if badge else ''
-            leaderboard += f'1. {bot_owner.name} - Level **∞** (∞ messages){badge_text}\n'
-        except:
-            pass
+    if is_bot_owner(member.id):
+        return await interaction.response.send_message(f'🏅 **Rank for {member.name}**\nRank: **#1**\nLevel: **∞**')
 
-    if not guild_levels:
-        if config['bot_owner']:
-            await interaction.response.send_message(leaderboard)
-        else:
-            await interaction.response.send_message('No level data available yet!')
-        return
+    rank_data = get_member_rank(interaction.guild.id, member.id)
+    if not rank_data:
+        return await interaction.response.send_message(f'{member.mention} has no level data yet!', ephemeral=True)
 
-    for i, data in enumerate(guild_levels):
-        if data['user_id'] == config['bot_owner']:
-            continue
-        try:
-            user = await bot.fetch_user(int(data['user_id']))
-            badge = get_user_badge(interaction.guild.id, data['user_id'])
-            badge_text = f' {badge}' if badge else ''
-            position = i + 2 if config['bot_owner'] else i + 1
-            leaderboard += f'{position}. {user.name} - Level **{data["level"]}** ({data["xp"]} messages){badge_text}\n'
-        except:
-            pass
+    level = get_level_from_xp(rank_data['xp'])['level']
+    if rank_data['next_rank']:
+        next_text = f'**{rank_data["gap"]}** messages behind **#{rank_data["next_rank"]}**'
+    else:
+        next_text = 'Top of the leaderboard!'
 
-    await interaction.response.send_message(leaderboard)
+    await interaction.response.send_message(
+        f'🏅 **Rank for {member.name}**\n'
+        f'Rank: **#{rank_data["rank"]}**\n'
+        f'Level: **{level}** ({rank_data["xp"]} messages)\n'
+        f'{next_text}'
+    )
 
 @bot.tree.command(name='mute', description='Timeout a user')
 @app_commands.describe(
@@ -953,16 +1950,14 @@ async def mute(interaction: discord.Interaction, member: discord.Member, duratio
             'end_time': (datetime.now() + timedelta(seconds=duration_seconds)).timestamp(),
             'reason': reason
         }
-        save_data()
+        schedule_expiry('mutes', key, active_mutes[key]['end_time'])
+        save_data('mutes', key)
 
-        try:
-            await member.send(
-                f'You have been muted in **{interaction.guild.name}**.\n'
-                f'Duration: {format_duration(duration_seconds)}\n'
-                f'Reason: {reason}'
-            )
-        except:
-            pass
+        queue_dm(member,
+            f'You have been muted in **{interaction.guild.name}**.\n'
+            f'Duration: {format_duration(duration_seconds)}\n'
+            f'Reason: {reason}'
+        )
 
         await interaction.response.send_message(f'✅ Successfully muted {member.mention} for {format_duration(duration_seconds)}')
     except Exception as e:
@@ -983,12 +1978,9 @@ async def unmute(interaction: discord.Interaction, member: discord.Member):
         key = f'{interaction.guild.id}-{member.id}'
         if key in active_mutes:
             del active_mutes[key]
-            save_data()
+            save_data('mutes', key)
 
-        try:
-            await member.send(f'Your timeout has been removed in **{interaction.guild.name}**.')
-        except:
-            pass
+        queue_dm(member, f'Your timeout has been removed in **{interaction.guild.name}**.')
 
         await interaction.response.send_message(f'✅ Successfully unmuted {member.mention}')
     except Exception as e:
@@ -1012,13 +2004,10 @@ async def ban(interaction: discord.Interaction, member: discord.Member, reason:
     if not is_admin(interaction.guild.id, interaction.user.id) and has_staff_permissions(member):
         return await interaction.response.send_message("You can't ban someone with staff permissions.", ephemeral=True)
 
-    try:
-        await member.send(
-            f'You have been banned from **{interaction.guild.name}**.\n'
-            f'Reason: {reason}'
-        )
-    except:
-        pass
+    await send_dm_before_action(member,
+        f'You have been banned from **{interaction.guild.name}**.\n'
+        f'Reason: {reason}'
+    )
 
     try:
         await member.ban(reason=reason)
@@ -1065,13 +2054,10 @@ async def kick(interaction: discord.Interaction, member: discord.Member, reason:
     if not is_admin(interaction.guild.id, interaction.user.id) and has_staff_permissions(member):
         return await interaction.response.send_message("You can't kick someone with staff permissions.", ephemeral=True)
 
-    try:
-        await member.send(
-            f'You have been kicked from **{interaction.guild.name}**.\n'
-            f'Reason: {reason}'
-        )
-    except:
-        pass
+    await send_dm_before_action(member,
+        f'You have been kicked from **{interaction.guild.name}**.\n'
+        f'Reason: {reason}'
+    )
 
     try:
         await member.kick(reason=reason)
@@ -1079,6 +2065,201 @@ async def kick(interaction: discord.Interaction, member: discord.Member, reason:
     except Exception as e:
         await interaction.response.send_message(f'Failed to kick user: {e}', ephemeral=True)
 
+# Mass moderation: /massban, /masskick and /masstimeout run as background
+# jobs. Each (guild, action) pair shares a semaphore, since Discord rate
+# limits these routes per guild, and a progress message is edited at most
+# every MASS_ACTION_PROGRESS_INTERVAL seconds. Targets get the same checks
+# as the single-user commands; no DMs are sent.
+MASS_ACTION_CONCURRENCY = int(os.getenv('MASS_ACTION_CONCURRENCY', '4'))
+MASS_ACTION_PROGRESS_INTERVAL = 3
+
+# action -> (verb while running, past tense, permission that allows it)
+MASS_ACTIONS = {
+    'ban': ('Banning', 'Banned', 'ban_members'),
+    'kick': ('Kicking', 'Kicked', 'kick_members'),
+    'timeout': ('Timing out', 'Timed out', 'moderate_members')
+}
+mass_action_limits = {}
+mass_action_jobs = set()
+
+def resolve_mass_targets(guild, targets, joined_within):
+    # User IDs or mentions in targets, plus members who joined within the
+    # given duration
+    user_ids = [int(user_id) for user_id in re.findall(r'\d{15,20}', targets or '')]
+    if joined_within:
+        seconds = parse_duration(joined_within)
+        if not seconds:
+            raise ValueError('Invalid duration format. Examples: `10m`, `1h`')
+        since = discord.utils.utcnow() - timedelta(seconds=seconds)
+        user_ids += [member.id for member in guild.members if member.joined_at and member.joined_at >= since]
+    return list(dict.fromkeys(user_ids))
+
+class MassActionJob:
+    def __init__(self, action, guild, moderator, user_ids, reason, duration=None):
+        self.action = action
+        self.guild = guild
+        self.moderator = moderator
+        self.user_ids = user_ids
+        self.reason = reason
+        self.duration = duration
+        self.done = 0
+        self.skipped = Counter()
+        self.failed = []
+        self.muted_keys = []
+        self.message = None
+        self.finished = False
+        self.changed = asyncio.Event()
+
+    def processed(self):
+        return self.done + sum(self.skipped.values()) + len(self.failed)
+
+    def progress_text(self):
+        verb, past, _ = MASS_ACTIONS[self.action]
+        if not self.finished:
+            return f'⏳ {verb} **{len(self.user_ids)}** accounts... {self.processed()}/{len(self.user_ids)}'
+
+        lines = [f'✅ Mass {self.action} finished: {past.lower()} **{self.done}** of {len(self.user_ids)} accounts']
+        for reason, count in self.skipped.most_common():
+            lines.append(f'Skipped ({reason}): **{count}**')
+        if self.failed:
+            shown = ', '.join(str(user_id) for user_id in self.failed[:20])
+            more = f' and {len(self.failed) - 20} more' if len(self.failed) > 20 else ''
+            lines.append(f'Failed: **{len(self.failed)}** ({shown}{more})')
+        return '\n'.join(lines)
+
+    def skip_reason(self, user_id, member):
+        # Same rules as /ban, /kick and /mute
+        if user_id in (self.moderator.id, bot.user.id):
+            return 'yourself or the bot'
+        if is_admin(self.guild.id, user_id):
+            return 'bot admin'
+        if member is None:
+            return None if self.action == 'ban' else 'not in the server'
+        if member.id == self.guild.owner_id:
+            return 'server owner'
+        if not is_admin(self.guild.id, self.moderator.id) and has_staff_permissions(member):
+            return 'staff'
+        return None
+
+    async def act(self, user_id, limit):
+        member = self.guild.get_member(user_id)
+        reason = self.skip_reason(user_id, member)
+        if reason:
+            self.skipped[reason] += 1
+            self.changed.set()
+            return
+
+        audit_reason = f'{self.reason} (mass {self.action} by {self.moderator})'
+        async with limit:
+            try:
+                if self.action == 'ban':
+                    await self.guild.ban(member or discord.Object(id=user_id), reason=audit_reason)
+                elif self.action == 'kick':
+                    await member.kick(reason=audit_reason)
+                else:
+                    await member.timeout(discord.utils.utcnow() + timedelta(seconds=self.duration), reason=audit_reason)
+                    key = f'{self.guild.id}-{user_id}'
+                    active_mutes[key] = {
+                        'end_time': (datetime.now() + timedelta(seconds=self.duration)).timestamp(),
+                        'reason': self.reason
+                    }
+                    schedule_expiry('mutes', key, active_mutes[key]['end_time'])
+                    self.muted_keys.append(key)
+                self.done += 1
+            except discord.HTTPException:
+                self.failed.append(user_id)
+        self.changed.set()
+
+    async def report_progress(self):
+        while not self.finished:
+            await self.changed.wait()
+            self.changed.clear()
+            await self.edit_progress()
+            await asyncio.sleep(MASS_ACTION_PROGRESS_INTERVAL)
+
+    async def edit_progress(self):
+        if self.message is None:
+            return
+        try:
+            await self.message.edit(content=self.progress_text())
+        except discord.HTTPException:
+            pass
+
+    async def run(self):
+        limit = mass_action_limits.setdefault((self.guild.id, self.action), asyncio.Semaphore(MASS_ACTION_CONCURRENCY))
+        reporter = asyncio.create_task(self.report_progress())
+        try:
+            await asyncio.gather(*(self.act(user_id, limit) for user_id in self.user_ids))
+        finally:
+            self.finished = True
+            reporter.cancel()
+            if self.muted_keys:
+                save_data('mutes', *self.muted_keys)
+            await self.edit_progress()
+
+async def start_mass_action(interaction, action, targets, joined_within, reason, duration=None):
+    if not interaction.guild:
+        return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
+    user_member = interaction.guild.get_member(interaction.user.id)
+    permission = MASS_ACTIONS[action][2]
+    if not is_admin(interaction.guild.id, interaction.user.id) and (not user_member or not getattr(user_member.guild_permissions, permission)):
+        return await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+
+    try:
+        user_ids = resolve_mass_targets(interaction.guild, targets, joined_within)
+    except ValueError as e:
+        return await interaction.response.send_message(str(e), ephemeral=True)
+    if not user_ids:
+        return await interaction.response.send_message('No matching accounts. Give user IDs/mentions or `joined_within`.', ephemeral=True)
+
+    job = MassActionJob(action, interaction.guild, interaction.user, user_ids, reason, duration)
+    # A channel message rather than the interaction response, which can
+    # only be edited for 15 minutes. The job runs without it if it can't
+    # be posted.
+    note = ''
+    try:
+        job.message = await interaction.channel.send(job.progress_text())
+    except discord.HTTPException:
+        note = ' I could not post progress in this channel, so no report will follow.'
+    await interaction.response.send_message(f'Started mass {action} of **{len(user_ids)}** accounts.{note}', ephemeral=True)
+
+    task = asyncio.create_task(job.run())
+    mass_action_jobs.add(task)
+    task.add_done_callback(mass_action_jobs.discard)
+
+@bot.tree.command(name='massban', description='Ban many accounts at once')
+@app_commands.describe(
+    targets='User IDs or mentions, separated by spaces',
+    joined_within='Also ban everyone who joined within this time (e.g. 10m, 1h)',
+    reason='Reason for the bans'
+)
+async def massban(interaction: discord.Interaction, targets: str = None, joined_within: str = None, reason: str = 'No reason provided'):
+    await start_mass_action(interaction, 'ban', targets, joined_within, reason)
+
+@bot.tree.command(name='masskick', description='Kick many members at once')
+@app_commands.describe(
+    targets='User IDs or mentions, separated by spaces',
+    joined_within='Also kick everyone who joined within this time (e.g. 10m, 1h)',
+    reason='Reason for the kicks'
+)
+async def masskick(interaction: discord.Interaction, targets: str = None, joined_within: str = None, reason: str = 'No reason provided'):
+    await start_mass_action(interaction, 'kick', targets, joined_within, reason)
+
+@bot.tree.command(name='masstimeout', description='Timeout many members at once')
+@app_commands.describe(
+    duration='Duration (e.g., 1m, 1h, 2d)',
+    targets='User IDs or mentions, separated by spaces',
+    joined_within='Also timeout everyone who joined within this time (e.g. 10m, 1h)',
+    reason='Reason for the timeouts'
+)
+async def masstimeout(interaction: discord.Interaction, duration: str, targets: str = None, joined_within: str = None, reason: str = 'No reason provided'):
+    duration_seconds = parse_duration(duration)
+    if not duration_seconds:
+        return await interaction.response.send_message('Invalid duration format. Examples: `1m`, `30s`, `1h`, `2d`', ephemeral=True)
+    if duration_seconds > MAX_TIMEOUT_SECONDS:
+        return await interaction.response.send_message('Timeouts can be at most 28 days.', ephemeral=True)
+    await start_mass_action(interaction, 'timeout', targets, joined_within, reason, duration_seconds)
+
 @bot.tree.command(name='warn', description='Warn a user')
 @app_commands.describe(
     member='The member to warn',
@@ -1104,28 +2285,27 @@ async def warn(interaction: discord.Interaction, member: discord.Member, reason:
         return await interaction.response.send_message(f"{member.mention} is currently protected and cannot be warned.", ephemeral=True)
 
     key = f'{interaction.guild.id}-{member.id}'
-    if key not in warns:
-        warns[key] = []
+    user_warns = warns.get(interaction.guild.id, member.id)
+    if user_warns is None:
+        user_warns = []
+        warns.set(interaction.guild.id, member.id, user_warns)
 
-    warn_id = max([w['id'] for w in warns[key]], default=0) + 1
-    warns[key].append({
+    warn_id = max([w['id'] for w in user_warns], default=0) + 1
+    user_warns.append({
         'id': warn_id,
         'reason': reason,
         'moderator': str(interaction.user.id),
         'timestamp': datetime.now().isoformat()
     })
-    save_data()
+    save_data('warns', key)
 
-    try:
-        await member.send(
-            f'You have been warned in **{interaction.guild.name}**.\n'
-            f'Reason: {reason}\n'
-            f'Warning ID: {warn_id}\n\n'
-            f'Please follow the server rules to avoid further action.'
-        )
-        await interaction.response.send_message(f'✅ Successfully warned {member.mention} (Warning #{warn_id})')
-    except:
-        await interaction.response.send_message(f'✅ Successfully warned {member.mention} (Warning #{warn_id}) (Could not send DM)')
+    queue_dm(member,
+        f'You have been warned in **{interaction.guild.name}**.\n'
+        f'Reason: {reason}\n'
+        f'Warning ID: {warn_id}\n\n'
+        f'Please follow the server rules to avoid further action.'
+    )
+    await interaction.response.send_message(f'✅ Successfully warned {member.mention} (Warning #{warn_id})')
 
 @bot.tree.command(name='viewwarns', description='View warnings for a user')
 @app_commands.describe(member='The member to check warnings for')
@@ -1136,8 +2316,7 @@ async def viewwarns(interaction: discord.Interaction, member: discord.Member):
     if not is_admin(interaction.guild.id, interaction.user.id) and (not user_member or not user_member.guild_permissions.moderate_members):
         return await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
-    key = f'{interaction.guild.id}-{member.id}'
-    user_warns = warns.get(key, [])
+    user_warns = warns.get(interaction.guild.id, member.id, [])
 
     if not user_warns:
         return await interaction.response.send_message(f'{member.mention} has no warnings.', ephemeral=True)
@@ -1147,12 +2326,10 @@ async def viewwarns(interaction: discord.Interaction, member: discord.Member):
         color=0xFF9900
     )
 
+    names = await resolve_user_names([warn['moderator'] for warn in user_warns], interaction.guild)
+
     for warn in user_warns:
-        try:
-            moderator = await bot.fetch_user(int(warn['moderator']))
-            mod_name = moderator.name
-        except:
-            mod_name = 'Unknown'
+        mod_name = names.get(int(warn['moderator']), 'Unknown')
 
         timestamp = datetime.fromisoformat(warn['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
         embed.add_field(
@@ -1176,7 +2353,7 @@ async def delwarn(interaction: discord.Interaction, member: discord.Member, warn
         return await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
     key = f'{interaction.guild.id}-{member.id}'
-    user_warns = warns.get(key, [])
+    user_warns = warns.get(interaction.guild.id, member.id, [])
 
     if not user_warns:
         return await interaction.response.send_message(f'{member.mention} has no warnings.', ephemeral=True)
@@ -1184,8 +2361,8 @@ async def delwarn(interaction: discord.Interaction, member: discord.Member, warn
     warn_found = False
     for i, warn in enumerate(user_warns):
         if warn['id'] == warn_id:
-            del warns[key][i]
-            save_data()
+            del user_warns[i]
+            save_data('warns', key)
             warn_found = True
             break
 
@@ -1209,11 +2386,8 @@ async def protection(interaction: discord.Interaction, member: discord.Member, d
     key = f'{interaction.guild.id}-{member.id}'
 
     if duration.lower() in ['inf', 'infinite', 'forever']:
-        protections[key] = {
-            'infinite': True,
-            'timestamp': datetime.now().isoformat()
-        }
-        save_data()
+        protections.set(interaction.guild.id, member.id, Protection(infinite=True, timestamp=datetime.now().isoformat()))
+        save_data('protections', key)
         await interaction.response.send_message(f'✅ {member.mention} is now protected from warnings indefinitely.')
     else:
         duration_seconds = parse_duration(duration)
@@ -1221,12 +2395,10 @@ async def protection(interaction: discord.Interaction, member: discord.Member, d
         if not duration_seconds:
             return await interaction.response.send_message('Invalid duration format. Use formats like "1h", "2d", or "inf" for infinite.', ephemeral=True)
 
-        protections[key] = {
-            'end_time': (datetime.now() + timedelta(seconds=duration_seconds)).timestamp(),
-            'infinite': False,
-            'timestamp': datetime.now().isoformat()
-        }
-        save_data()
+        end_time = (datetime.now() + timedelta(seconds=duration_seconds)).timestamp()
+        protections.set(member.guild.id, member.id, Protection(end_time, False, datetime.now().isoformat()))
+        schedule_expiry('protections', (member.guild.id, member.id), end_time)
+        save_data('protections', key)
 
         await interaction.response.send_message(f'✅ {member.mention} is now protected from warnings for {format_duration(duration_seconds)}.')
 
@@ -1242,11 +2414,9 @@ async def removeprotection(interaction: discord.Interaction, member: discord.Mem
 
     key = f'{interaction.guild.id}-{member.id}'
 
-    if key not in protections:
+    if protections.pop(member.guild.id, member.id) is None:
         return await interaction.response.send_message(f'{member.mention} is not currently protected.', ephemeral=True)
-
-    del protections[key]
-    save_data()
+    save_data('protections', key)
 
     await interaction.response.send_message(f'✅ Protection removed from {member.mention}.')
 
@@ -1268,7 +2438,8 @@ async def removelevelnames(interaction: discord.Interaction, channel: discord.Te
         return await interaction.response.send_message(f'Level-up notifications are already disabled in {channel.mention}.', ephemeral=True)
 
     level_blacklist[guild_id].append(channel_id)
-    save_data()
+    refresh_guild_settings(guild_id)
+    save_data('level_blacklist')
 
     await interaction.response.send_message(f'✅ Level-up notifications have been disabled in {channel.mention}.')
 
@@ -1352,11 +2523,49 @@ async def addit(interaction: discord.Interaction):
 
     guild_id = str(interaction.guild.id)
     config['welcome_dm'][guild_id] = not config['welcome_dm'].get(guild_id, False)
-    save_data()
+    save_data('config')
 
     status = 'enabled' if config['welcome_dm'][guild_id] else 'disabled'
     await interaction.response.send_message(f'✅ Welcome DM has been {status}.')
 
+@bot.tree.command(name='raidprotection', description='Configure what happens when a raid is detected (Admin+)')
+@app_commands.describe(
+    pause_welcome_dms='Stop sending welcome DMs during a raid',
+    timeout='Timeout new joins during a raid for this long (e.g. 1h), or "off"',
+    alert_channel='Channel to alert moderators in when a raid starts'
+)
+async def raidprotection(interaction: discord.Interaction, pause_welcome_dms: bool = None, timeout: str = None, alert_channel: discord.TextChannel = None):
+    if not interaction.guild:
+        return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
+    if not is_admin(interaction.guild.id, interaction.user.id):
+        return await interaction.response.send_message('You need to be an admin+ to use this command.', ephemeral=True)
+
+    guild_id = str(interaction.guild.id)
+    settings = config['raid_protection'].setdefault(guild_id, {})
+    if pause_welcome_dms is not None:
+        settings['pause_welcome_dms'] = pause_welcome_dms
+    if timeout is not None:
+        seconds = 0 if timeout.lower() == 'off' else parse_duration(timeout)
+        if seconds is None:
+            return await interaction.response.send_message('Invalid duration format. Examples: `10m`, `1h`, or `off`', ephemeral=True)
+        if seconds > MAX_TIMEOUT_SECONDS:
+            return await interaction.response.send_message('Timeouts can be at most 28 days.', ephemeral=True)
+        settings['timeout'] = seconds
+    if alert_channel is not None:
+        settings['alert_channel'] = str(alert_channel.id)
+    save_data('config')
+
+    settings = get_raid_protection(guild_id)
+    detector = raid_detectors.get(interaction.guild.id)
+    status = 'raid in progress' if detector and detector.in_raid(time.monotonic()) else 'no raid'
+    alert = f'<#{settings["alert_channel"]}>' if settings['alert_channel'] else '**none**'
+    await interaction.response.send_message(
+        f'🛡️ **Raid Protection** ({status})\n'
+        f'Pause welcome DMs: **{"on" if settings["pause_welcome_dms"] else "off"}**\n'
+        f'Timeout new joins: **{format_duration(settings["timeout"]) if settings["timeout"] else "off"}**\n'
+        f'Alert channel: {alert}'
+    )
+
 @bot.tree.command(name='truthordare', description='Get a random truth or dare')
 async def truthordare(interaction: discord.Interaction):
     truths = [
@@ -1655,7 +2864,55 @@ async def balance(interaction: discord.Interaction):
     if not interaction.guild:
         return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
     user_data = get_user_balance(interaction.guild.id, interaction.user.id)
-    await interaction.response.send_message(f'💰 You have **{user_data["coins"]}** coins!')
+    await interaction.response.send_message(f'💰 You have **{user_data.coins}** coins!')
+
+async def build_economy_summary(guild):
+    total = gambling_data.total(guild.id, 'coins')
+    richest = gambling_data.top(guild.id, 'coins', 5)
+    if not richest:
+        return 'No one in this server has any coins yet.'
+
+    lines = [f'🏦 **{guild.name} Economy**', f'Total coins: **{total}** across **{gambling_data.count(guild.id)}** members', '']
+    for position, (user_id, coins) in enumerate(richest, start=1):
+        member = guild.get_member(user_id)
+        name = member.display_name if member else f'User {user_id}'
+        lines.append(f'**#{position}** {name} - {coins} coins')
+    return '\n'.join(lines)
+
+@bot.tree.command(name='economy', description='Show the server coin total and richest members')
+async def economy(interaction: discord.Interaction):
+    if not interaction.guild:
+        return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
+    await interaction.response.send_message(await build_economy_summary(interaction.guild))
+
+@bot.tree.command(name='resetstats', description="Reset everyone's XP or coins in this server (Owner+)")
+@app_commands.describe(stat='What to reset')
+@app_commands.choices(stat=[
+    app_commands.Choice(name='Levels (XP)', value='levels'),
+    app_commands.Choice(name='Economy (coins)', value='economy')
+])
+async def resetstats(interaction: discord.Interaction, stat: app_commands.Choice[str]):
+    if not interaction.guild:
+        return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
+    if not is_owner(interaction.guild.id, interaction.user.id):
+        return await interaction.response.send_message('Only owners can reset server stats.', ephemeral=True)
+
+    guild_id = interaction.guild.id
+    if stat.value == 'levels':
+        for key in [key for key in pending_xp if key[0] == guild_id]:
+            del pending_xp[key]
+        levels.reset(guild_id, 'xp', 0)
+        build_leaderboard(guild_id)
+        name, store, field = 'levels', levels, 'xp'
+    else:
+        gambling_data.reset(guild_id, 'coins', Balance().coins)
+        name, store, field = 'gambling', gambling_data, 'coins'
+
+    keys = [f'{guild_id}-{user_id}' for user_id, _ in store.pairs(guild_id, field)]
+    if keys:
+        save_data(name, *keys)
+
+    await interaction.response.send_message(f'✅ Reset {stat.name} for **{store.count(guild_id)}** members.')
 
 @bot.tree.command(name='gamble', description='Gamble your coins in interactive games')
 @app_commands.describe(amount='Amount of coins to gamble')
@@ -1667,8 +2924,8 @@ async def gamble(interaction: discord.Interaction, amount: int):
 
     user_data = get_user_balance(interaction.guild.id, interaction.user.id)
 
-    if user_data['coins'] < amount:
-        return await interaction.response.send_message(f'You don\'t have enough coins! Your balance: **{user_data["coins"]}** coins', ephemeral=True)
+    if user_data.coins < amount:
+        return await interaction.response.send_message(f'You don\'t have enough coins! Your balance: **{user_data.coins}** coins', ephemeral=True)
 
     view = GambleView(interaction, amount)
     await interaction.response.send_message(f'💰 Gambling **{amount}** coins! Choose a game:', view=view)
@@ -1686,8 +2943,8 @@ async def roulette(interaction: discord.Interaction, amount: int, bet: str):
 
     user_data = get_user_balance(interaction.guild.id, interaction.user.id)
 
-    if user_data['coins'] < amount:
-        return await interaction.response.send_message(f'You don\'t have enough coins! Your balance: **{user_data["coins"]}** coins', ephemeral=True)
+    if user_data.coins < amount:
+        return await interaction.response.send_message(f'You don\'t have enough coins! Your balance: **{user_data.coins}** coins', ephemeral=True)
 
     bet = bet.lower()
 
@@ -1718,22 +2975,22 @@ async def roulette(interaction: discord.Interaction, amount: int, bet: str):
 
     if won:
         winnings = amount * multiplier
-        user_data['coins'] += winnings - amount
-        save_data()
+        user_data.coins += winnings - amount
+        save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
         await interaction.response.send_message(
             f'🎰 **Roulette**\n\n'
             f'The ball landed on **{winning_number}** ({winning_color})!\n'
             f'🎉 You won **{winnings}** coins!\n\n'
-            f'New balance: **{user_data["coins"]}** coins'
+            f'New balance: **{user_data.coins}** coins'
         )
     else:
-        user_data['coins'] -= amount
-        save_data()
+        user_data.coins -= amount
+        save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
         await interaction.response.send_message(
             f'🎰 **Roulette**\n\n'
             f'The ball landed on **{winning_number}** ({winning_color})!\n'
             f'😢 You lost **{amount}** coins!\n\n'
-            f'New balance: **{user_data["coins"]}** coins'
+            f'New balance: **{user_data.coins}** coins'
         )
 
 
@@ -1783,32 +3040,32 @@ async def buy(interaction: discord.Interaction, item: app_commands.Choice[str]):
     user_data = get_user_balance(interaction.guild.id, interaction.user.id)
 
     if item.value == '1':
-        if user_data['coins'] < 5000:
+        if user_data.coins < 5000:
             return await interaction.response.send_message('You need 5000 coins to buy this item!', ephemeral=True)
 
-        user_data['coins'] -= 5000
-        user_data['items'].append('custom_role_color')
-        save_data()
+        user_data.coins -= 5000
+        user_data.items.append('custom_role_color')
+        save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
         await interaction.response.send_message('✅ You purchased a Custom Role Color! Contact an admin to set it up.')
 
     elif item.value == '2':
-        if user_data['coins'] < 10000:
+        if user_data.coins < 10000:
             return await interaction.response.send_message('You need 10000 coins to buy this item!', ephemeral=True)
 
-        user_data['coins'] -= 10000
-        user_data['items'].append('vip_badge')
-        save_data()
+        user_data.coins -= 10000
+        user_data.items.append('vip_badge')
+        save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
         await interaction.response.send_message('✅ You purchased a VIP Badge! 👑')
 
     elif item.value == '3':
-        if user_data['coins'] < 2000:
+        if user_data.coins < 2000:
             return await interaction.response.send_message('You need 2000 coins to buy this item!', ephemeral=True)
 
         bonus = random.randint(500, 5000)
-        user_data['coins'] -= 2000
-        user_data['coins'] += bonus
-        save_data()
-        await interaction.response.send_message(f'🎁 You opened a Mystery Box and got **{bonus}** coins! New balance: **{user_data["coins"]}** coins')
+        user_data.coins -= 2000
+        user_data.coins += bonus
+        save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
+        await interaction.response.send_message(f'🎁 You opened a Mystery Box and got **{bonus}** coins! New balance: **{user_data.coins}** coins')
 
 @bot.tree.command(name='daily', description='Claim your daily coins')
 async def daily(interaction: discord.Interaction):
@@ -1817,14 +3074,14 @@ async def daily(interaction: discord.Interaction):
     user_data = get_user_balance(interaction.guild.id, interaction.user.id)
     now = datetime.now().timestamp()
 
-    if now - user_data['last_daily'] < 86400:
-        time_left = 86400 - (now - user_data['last_daily'])
+    if now - user_data.last_daily < 86400:
+        time_left = 86400 - (now - user_data.last_daily)
         await interaction.response.send_message(f'⏰ You already claimed your daily reward! Come back in {format_duration(int(time_left))}', ephemeral=True)
     else:
-        user_data['coins'] += 500
-        user_data['last_daily'] = now
-        save_data()
-        await interaction.response.send_message(f'🎁 You claimed your daily **500** coins! New balance: **{user_data["coins"]}** coins')
+        user_data.coins += 500
+        user_data.last_daily = now
+        save_data('gambling', f'{interaction.guild.id}-{interaction.user.id}')
+        await interaction.response.send_message(f'🎁 You claimed your daily **500** coins! New balance: **{user_data.coins}** coins')
 
 @bot.tree.command(name='poll', description='Create a poll')
 @app_commands.describe(
@@ -1867,12 +3124,7 @@ async def poll(interaction: discord.Interaction, question: str, options: str):
 async def afk(interaction: discord.Interaction, reason: str = 'AFK'):
     if not interaction.guild:
         return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
-    user_key = f'{interaction.guild.id}-{interaction.user.id}'
-    afk_users[user_key] = {
-        'reason': reason,
-        'timestamp': datetime.now().timestamp()
-    }
-    save_data()
+    set_afk(interaction.guild.id, interaction.user.id, reason)
 
     await interaction.response.send_message(f'{interaction.user.mention} has gone AFK: {reason}')
 
@@ -1910,16 +3162,13 @@ async def commandban(interaction: discord.Interaction, user: discord.User, reaso
         'moderator': str(interaction.user.id),
         'timestamp': datetime.now().isoformat()
     }
-    save_data()
+    save_data('command_penalties', user_id_str)
 
-    try:
-        await user.send(
-            f'❌ You have been banned from using bot commands.\n'
-            f'Reason: {reason}\n\n'
-            f'Contact the bot owner if you believe this is a mistake.'
-        )
-    except:
-        pass
+    queue_dm(user,
+        f'❌ You have been banned from using bot commands.\n'
+        f'Reason: {reason}\n\n'
+        f'Contact the bot owner if you believe this is a mistake.'
+    )
 
     await interaction.response.send_message(f'✅ Successfully banned {user.mention} from using bot commands.')
 
@@ -1935,14 +3184,9 @@ async def commandunban(interaction: discord.Interaction, user: discord.User):
         return await interaction.response.send_message(f'{user.mention} is not command banned.', ephemeral=True)
 
     del command_penalties[user_id_str]
-    save_data()
+    save_data('command_penalties', user_id_str)
 
-    try:
-        await user.send(
-            f'✅ Your command ban has been lifted. You can now use bot commands again.'
-        )
-    except:
-        pass
+    queue_dm(user, '✅ Your command ban has been lifted. You can now use bot commands again.')
 
     await interaction.response.send_message(f'✅ Successfully unbanned {user.mention} from using bot commands.')
 
@@ -1969,17 +3213,15 @@ async def commandmute(interaction: discord.Interaction, user: discord.User, dura
         'timestamp': datetime.now().isoformat(),
         'end_time': (datetime.now() + timedelta(seconds=duration_seconds)).timestamp()
     }
-    save_data()
-
-    try:
-        await user.send(
-            f'🔇 You have been temporarily muted from using bot commands.\n'
-            f'Duration: {format_duration(duration_seconds)}\n'
-            f'Reason: {reason}\n\n'
-            f'You will be able to use commands again after the duration expires.'
-        )
-    except:
-        pass
+    schedule_expiry('command_penalties', user_id_str, command_penalties[user_id_str]['end_time'])
+    save_data('command_penalties', user_id_str)
+
+    queue_dm(user,
+        f'🔇 You have been temporarily muted from using bot commands.\n'
+        f'Duration: {format_duration(duration_seconds)}\n'
+        f'Reason: {reason}\n\n'
+        f'You will be able to use commands again after the duration expires.'
+    )
 
     await interaction.response.send_message(f'✅ Successfully muted {user.mention} from using bot commands for {format_duration(duration_seconds)}.')
 
@@ -1995,14 +3237,9 @@ async def commandunmute(interaction: discord.Interaction, user: discord.User):
         return await interaction.response.send_message(f'{user.mention} is not command muted.', ephemeral=True)
 
     del command_penalties[user_id_str]
-    save_data()
+    save_data('command_penalties', user_id_str)
 
-    try:
-        await user.send(
-            f'✅ Your command mute has been lifted. You can now use bot commands again.'
-        )
-    except:
-        pass
+    queue_dm(user, '✅ Your command mute has been lifted. You can now use bot commands again.')
 
     await interaction.response.send_message(f'✅ Successfully unmuted {user.mention} from using bot commands.')
 
@@ -2015,16 +3252,50 @@ async def commandwarn(interaction: discord.Interaction, user: discord.User, reas
     if not is_bot_owner(interaction.user.id):
         return await interaction.response.send_message('Only the bot owner can use this command.', ephemeral=True)
 
-    try:
-        await user.send(
-            f'⚠️ **Command Usage Warning**\n\n'
-            f'You have received a warning about your bot command usage.\n'
-            f'Reason: {reason}\n\n'
-            f'Please be mindful of how you use bot commands. Repeated violations may result in a command ban.'
-        )
-        await interaction.response.send_message(f'✅ Successfully warned {user.mention} about command usage.')
-    except:
-        await interaction.response.send_message(f'✅ Warning recorded for {user.mention}, but could not send DM.')
+    queue_dm(user,
+        f'⚠️ **Command Usage Warning**\n\n'
+        f'You have received a warning about your bot command usage.\n'
+        f'Reason: {reason}\n\n'
+        f'Please be mindful of how you use bot commands. Repeated violations may result in a command ban.'
+    )
+    await interaction.response.send_message(f'✅ Successfully warned {user.mention} about command usage.')
+
+def format_perf_stats():
+    sent = dm_stats['sent']
+    avg_delivery = dm_stats['delivery_ms'] / sent if sent else 0
+    return (
+        f'📈 **Performance Stats**\n\n'
+        f'**DM Outbox**\n'
+        f'Queued: **{dm_queue.qsize()}**/{DM_QUEUE_SIZE}\n'
+        f'Sent: **{sent}** (avg {avg_delivery:.0f} ms after queueing)\n'
+        f'Retried: **{dm_stats["retried"]}**\n'
+        f'Dropped (DMs closed): **{dm_stats["dropped_closed"]}**\n'
+        f'Dropped (queue full): **{dm_stats["dropped_full"]}**\n'
+        f'Failed: **{dm_stats["failed"]}**'
+        f'{format_loaded_guilds()}'
+        f'{format_command_timings()}'
+    )
+
+def format_loaded_guilds():
+    if not isinstance(gambling_data, PartitionedStore):
+        return ''
+    return f'\n\n**Loaded Guilds**\n{len(gambling_data.guilds)} of the {len(bot.guilds)} guilds the bot is in'
+
+def format_command_timings(limit=10):
+    if not command_timings:
+        return ''
+    # Slowest commands first, by average time to first response
+    slowest = sorted(command_timings.items(), key=lambda item: item[1][1] / item[1][0], reverse=True)
+    lines = ['\n\n**Slash Commands** (time to first response)']
+    for name, (count, total_ms, max_ms, deferred) in slowest[:limit]:
+        lines.append(f'/{name}: avg **{total_ms / count:.0f} ms**, max {max_ms:.0f} ms, {count} runs, {deferred} auto-deferred')
+    return '\n'.join(lines)
+
+@bot.tree.command(name='perfstats', description='View bot performance stats (Bot Owner)')
+async def perfstats(interaction: discord.Interaction):
+    if not is_bot_owner(interaction.user.id):
+        return await interaction.response.send_message('Only the bot owner can use this command.', ephemeral=True)
+    await interaction.response.send_message(format_perf_stats(), ephemeral=True)
 
 @bot.command(name='help')
 async def help_prefix(ctx):
@@ -2048,7 +3319,8 @@ async def help_prefix(ctx):
     embed.add_field(
         name='**Leveling System**',
         value='/levelstats - View your level and progress\n'
-              '/levelboard - View top 10 users by level\n'
+              '/levelboard [page] - View the level leaderboard\n'
+              '/rank [user] - View leaderboard position\n'
               '/addlevels <user> <amount> or ?addlevels <@user> <amount> - Add levels to a user (Admin+)\n'
               '/removelevels <user> <amount> or ?removelevels <@user> <amount> - Remove levels from a user (Admin+)',
         inline=False
@@ -2061,6 +3333,9 @@ async def help_prefix(ctx):
               '/ban <user> [reason] - Ban user\n'
               '/unban <user_id> - Unban user by ID\n'
               '/kick <user> [reason] - Kick user\n'
+              '/massban [targets] [joined_within] [reason] - Ban many accounts\n'
+              '/masskick [targets] [joined_within] [reason] - Kick many members\n'
+              '/masstimeout <duration> [targets] [joined_within] [reason] - Timeout many members\n'
               '/warn <user> <reason> - Warn user\n'
               '/viewwarns <user> - View user warnings\n'
               '/delwarn <user> <warn_id> - Delete a warning\n'
@@ -2075,7 +3350,8 @@ async def help_prefix(ctx):
               '/commandunban <user> - Unban from commands\n'
               '/commandmute <user> <duration> [reason] - Mute from commands\n'
               '/commandunmute <user> - Unmute from commands\n'
-              '/commandwarn <user> [reason] - Warn about command usage',
+              '/commandwarn <user> [reason] - Warn about command usage\n'
+              '/perfstats - View performance stats',
         inline=False
     )
 
@@ -2113,7 +3389,9 @@ async def help_prefix(ctx):
               '/roulette <amount> <bet> - Roulette betting game\n'
               '/shop - View the shop\n'
               '/buy <item> - Buy an item from the shop\n'
-              '/daily - Claim your daily coins',
+              '/daily - Claim your daily coins\n'
+              '/economy - Server coin total and richest members\n'
+              '/resetstats <levels|economy> - Reset the server\'s XP or coins (Owner+)',
         inline=False
     )
 
@@ -2122,13 +3400,14 @@ async def help_prefix(ctx):
         value='/poll <question> <options> - Create a poll\n'
               '/afk [reason] - Set yourself as AFK\n'
               '/addit - Toggle welcome DM system (Admin+)\n'
+              '/raidprotection [pause_welcome_dms] [timeout] [alert_channel] - Raid response (Admin+)\n'
               '/beta - Display bot beta status',
         inline=False
     )
 
     embed.add_field(
         name='**Giveaway Commands (Admin+)**',
-        value='/giveaway create <duration> <winners> <prize> <channel> - Create a giveaway\n'
+        value='/giveaway create <duration> <winners> <prize> <channel> [weighting] [role_weights] - Create a giveaway\n'
               '/giveaway end <message_id> - End a giveaway early\n'
               '/giveaway reroll <message_id> - Reroll giveaway winners\n'
               '/giveaway list - List active giveaways',
@@ -2145,7 +3424,8 @@ async def newprefix_prefix(ctx, new_prefix: str):
         return await ctx.send('You need to be an admin to use this command.')
 
     config['prefixes'][str(ctx.guild.id)] = new_prefix
-    save_data()
+    refresh_guild_settings(ctx.guild.id)
+    save_data('config')
     await ctx.send(f'✅ Prefix changed to `{new_prefix}`')
 
 @bot.command(name='protection')
@@ -2157,11 +3437,8 @@ async def protection_prefix(ctx, duration: str, member: discord.Member):
     key = f'{ctx.guild.id}-{member.id}'
 
     if duration.lower() in ['inf', 'infinite', 'forever']:
-        protections[key] = {
-            'infinite': True,
-            'timestamp': datetime.now().isoformat()
-        }
-        save_data()
+        protections.set(ctx.guild.id, member.id, Protection(infinite=True, timestamp=datetime.now().isoformat()))
+        save_data('protections', key)
         await ctx.send(f'✅ {member.mention} is now protected from warnings indefinitely.')
     else:
         duration_seconds = parse_duration(duration)
@@ -2169,12 +3446,10 @@ async def protection_prefix(ctx, duration: str, member: discord.Member):
         if not duration_seconds:
             return await ctx.send('Invalid duration format. Use formats like "1h", "2d", or "inf" for infinite.')
 
-        protections[key] = {
-            'end_time': (datetime.now() + timedelta(seconds=duration_seconds)).timestamp(),
-            'infinite': False,
-            'timestamp': datetime.now().isoformat()
-        }
-        save_data()
+        end_time = (datetime.now() + timedelta(seconds=duration_seconds)).timestamp()
+        protections.set(member.guild.id, member.id, Protection(end_time, False, datetime.now().isoformat()))
+        schedule_expiry('protections', (member.guild.id, member.id), end_time)
+        save_data('protections', key)
 
         await ctx.send(f'✅ {member.mention} is now protected from warnings for {format_duration(duration_seconds)}.')
 
@@ -2187,11 +3462,9 @@ async def removeprotection_prefix(ctx, member: discord.Member):
 
     key = f'{ctx.guild.id}-{member.id}'
 
-    if key not in protections:
+    if protections.pop(member.guild.id, member.id) is None:
         return await ctx.send(f'{member.mention} is not currently protected.')
-
-    del protections[key]
-    save_data()
+    save_data('protections', key)
 
     await ctx.send(f'✅ Protection removed from {member.mention}.')
 
@@ -2210,7 +3483,8 @@ async def removelevelnames_prefix(ctx, channel: discord.TextChannel):
         return await ctx.send(f'Level-up notifications are already disabled in {channel.mention}.')
 
     level_blacklist[guild_id].append(channel_id)
-    save_data()
+    refresh_guild_settings(guild_id)
+    save_data('level_blacklist')
 
     await ctx.send(f'✅ Level-up notifications have been disabled in {channel.mention}.')
 
@@ -2236,20 +3510,17 @@ async def addlevels_prefix(ctx, member: discord.Member, amount: int):
     if amount <= 0:
         return await ctx.send('Please specify a positive amount of levels to add.')
 
-    key = f'{ctx.guild.id}-{member.id}'
-    if key not in levels:
-        levels[key] = {'xp': 0, 'last_message': 0}
+    commit_pending_xp([(ctx.guild.id, member.id)])
+    entry = levels.get(ctx.guild.id, member.id)
+    if entry is None:
+        levels.set(ctx.guild.id, member.id, LevelEntry())
+        entry = levels.get(ctx.guild.id, member.id)
 
-    # Calculate XP needed for the amount of levels
-    xp_to_add = 0
-    for i in range(amount):
-        current_level = get_level_from_xp(levels[key]['xp'] + xp_to_add)['level']
-        xp_to_add += get_messages_for_level(current_level + 1)
+    entry.xp += get_xp_to_add_levels(entry.xp, amount)
+    update_leaderboard(ctx.guild.id, member.id, entry.xp)
+    save_data('levels', f'{ctx.guild.id}-{member.id}')
 
-    levels[key]['xp'] += xp_to_add
-    save_data()
-
-    new_level = get_level_from_xp(levels[key]['xp'])['level']
+    new_level = get_level_from_xp(entry.xp)['level']
     await ctx.send(f'✅ Added {amount} levels to {member.mention}. They are now level {new_level}.')
 
 @bot.command(name='removelevels')
@@ -2260,27 +3531,26 @@ async def removelevels_prefix(ctx, member: discord.Member, amount: int):
     if amount <= 0:
         return await ctx.send('Please specify a positive amount of levels to remove.')
 
+    commit_pending_xp([(ctx.guild.id, member.id)])
     key = f'{ctx.guild.id}-{member.id}'
-    if key not in levels:
+    entry = levels.get(ctx.guild.id, member.id)
+    if entry is None:
         return await ctx.send(f'{member.mention} has no levels to remove.')
 
-    current_level = get_level_from_xp(levels[key]['xp'])['level']
+    current_level = get_level_from_xp(entry.xp)['level']
 
     if amount > current_level:
-        levels[key]['xp'] = 0
-        save_data()
+        entry.xp = 0
+        update_leaderboard(ctx.guild.id, member.id, 0)
+        save_data('levels', key)
         return await ctx.send(f'✅ Removed all levels from {member.mention}. They are now level 0.')
 
-    # Calculate XP to remove
-    xp_to_remove = 0
-    for i in range(amount):
-        level_to_remove = current_level - i
-        xp_to_remove += get_messages_for_level(level_to_remove)
-
-    levels[key]['xp'] = max(0, levels[key]['xp'] - xp_to_remove)
-    save_data()
+    xp_to_remove = get_xp_to_remove_levels(current_level, amount)
+    entry.xp = max(0, entry.xp - xp_to_remove)
+    update_leaderboard(ctx.guild.id, member.id, entry.xp)
+    save_data('levels', key)
 
-    new_level = get_level_from_xp(levels[key]['xp'])['level']
+    new_level = get_level_from_xp(entry.xp)['level']
     await ctx.send(f'✅ Removed {amount} levels from {member.mention}. They are now level {new_level}.')
 
 @bot.command(name='setbotowner')
@@ -2288,7 +3558,7 @@ async def setbotowner_prefix(ctx):
     if config['bot_owner']:
         return await ctx.send('Bot owner has already been set!')
     config['bot_owner'] = str(ctx.author.id)
-    save_data()
+    save_data('config')
     await ctx.send(f'✅ {ctx.author.mention} is now the bot owner!')
 
 @bot.command(name='addowner')
@@ -2302,7 +3572,7 @@ async def addowner_prefix(ctx, user: discord.Member = None):
         config['owners'][guild_id] = []
     if user_id not in config['owners'][guild_id]:
         config['owners'][guild_id].append(user_id)
-        save_data()
+        save_data('config')
         await ctx.send(f'✅ {user.name} is now an owner.')
     else:
         await ctx.send(f'{user.name} is already an owner.')
@@ -2316,7 +3586,7 @@ async def removeowner_prefix(ctx, user: discord.Member = None):
     guild_id, user_id = str(ctx.guild.id), str(user.id)
     if guild_id in config['owners'] and user_id in config['owners'][guild_id]:
         config['owners'][guild_id].remove(user_id)
-        save_data()
+        save_data('config')
         await ctx.send(f'✅ {user.name} has been removed as owner.')
     else:
         await ctx.send(f'{user.name} is not an owner.')
@@ -2332,7 +3602,7 @@ async def addadmin_prefix(ctx, user: discord.Member = None):
         config['admins'][guild_id] = []
     if user_id not in config['admins'][guild_id]:
         config['admins'][guild_id].append(user_id)
-        save_data()
+        save_data('config')
         await ctx.send(f'✅ {user.name} is now an admin.')
     else:
         await ctx.send(f'{user.name} is already an admin.')
@@ -2346,7 +3616,7 @@ async def removeadmin_prefix(ctx, user: discord.Member = None):
     guild_id, user_id = str(ctx.guild.id), str(user.id)
     if guild_id in config['admins'] and user_id in config['admins'][guild_id]:
         config['admins'][guild_id].remove(user_id)
-        save_data()
+        save_data('config')
         await ctx.send(f'✅ {user.name} has been removed as admin.')
     else:
         await ctx.send(f'{user.name} is not an admin.')
@@ -2357,23 +3627,29 @@ async def levelstats_prefix(ctx):
     badge_text = f' {badge}' if badge else ''
     if is_bot_owner(ctx.author.id):
         return await ctx.send(f'📊 **Your Level Stats**{badge_text}\nLevel: **∞**\nTotal Messages: **∞**\nProgress: **MAX LEVEL**')
-    key = f'{ctx.guild.id}-{ctx.author.id}'
-    user_data = levels.get(key, {'xp': 0})
-    level_data = get_level_from_xp(user_data['xp'])
-    await ctx.send(f'📊 **Your Level Stats**{badge_text}\nLevel: **{level_data["level"]}**\nTotal Messages: **{user_data["xp"]}**\nProgress: **{level_data["messages_in_level"]}/{level_data["messages_needed"]}** to next level')
+    xp = get_user_xp(ctx.guild.id, ctx.author.id)
+    level_data = get_level_from_xp(xp)
+    await ctx.send(f'📊 **Your Level Stats**{badge_text}\nLevel: **{level_data["level"]}**\nTotal Messages: **{xp}**\nProgress: **{level_data["messages_in_level"]}/{level_data["messages_needed"]}** to next level')
 
 @bot.command(name='levelboard')
-async def levelboard_prefix(ctx):
-    guild_levels = [{'user_id': k.split('-')[1], 'level': get_level_from_xp(v['xp'])['level'], 'xp': v['xp']} for k, v in levels.items() if k.startswith(str(ctx.guild.id))]
-    guild_levels.sort(key=lambda x: x['xp'], reverse=True)
-    leaderboard = '🏆 **Level Leaderboard**\n\n'
-    if config['bot_owner']:
-        leaderboard += f'1. {(await bot.fetch_user(int(config["bot_owner"]))).name} - Level **∞**\n'
-    for i, data in enumerate(guild_levels[:10]):
-        if data['user_id'] != config['bot_owner']:
-            user = await bot.fetch_user(int(data['user_id']))
-            leaderboard += f'{i+2}. {user.name} - Level **{data["level"]}** ({data["xp"]} messages)\n'
-    await ctx.send(leaderboard)
+async def levelboard_prefix(ctx, page: int = 1):
+    content, page, pages = await build_levelboard_page(ctx.guild, page - 1)
+    if pages == 1:
+        return await ctx.send(content)
+    view = LevelboardView(ctx.guild, ctx.author.id, page, pages)
+    view.message = await ctx.send(content, view=view)
+
+@bot.command(name='rank')
+async def rank_prefix(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    if is_bot_owner(member.id):
+        return await ctx.send(f'🏅 **Rank for {member.name}**\nRank: **#1**\nLevel: **∞**')
+    rank_data = get_member_rank(ctx.guild.id, member.id)
+    if not rank_data:
+        return await ctx.send(f'{member.mention} has no level data yet!')
+    level = get_level_from_xp(rank_data['xp'])['level']
+    next_text = f'**{rank_data["gap"]}** messages behind **#{rank_data["next_rank"]}**' if rank_data['next_rank'] else 'Top of the leaderboard!'
+    await ctx.send(f'🏅 **Rank for {member.name}**\nRank: **#{rank_data["rank"]}**\nLevel: **{level}** ({rank_data["xp"]} messages)\n{next_text}')
 
 @bot.command(name='mute')
 async def mute_prefix(ctx, member: discord.Member = None, *, duration_and_reason: str = None):
@@ -2390,7 +3666,8 @@ async def mute_prefix(ctx, member: discord.Member = None, *, duration_and_reason
     try:
         await member.timeout(discord.utils.utcnow() + timedelta(seconds=duration_seconds), reason=reason)
         active_mutes[f'{ctx.guild.id}-{member.id}'] = {'end_time': (datetime.now() + timedelta(seconds=duration_seconds)).timestamp(), 'reason': reason}
-        save_data()
+        schedule_expiry('mutes', f'{ctx.guild.id}-{member.id}', active_mutes[f'{ctx.guild.id}-{member.id}']['end_time'])
+        save_data('mutes', f'{ctx.guild.id}-{member.id}')
         await ctx.send(f'✅ Muted {member.mention} for {format_duration(duration_seconds)}')
     except Exception as e:
         await ctx.send(f'Failed: {e}')
@@ -2405,7 +3682,7 @@ async def unmute_prefix(ctx, member: discord.Member = None):
         await member.timeout(None)
         if f'{ctx.guild.id}-{member.id}' in active_mutes:
             del active_mutes[f'{ctx.guild.id}-{member.id}']
-            save_data()
+            save_data('mutes', f'{ctx.guild.id}-{member.id}')
         await ctx.send(f'✅ Unmuted {member.mention}')
     except Exception as e:
         await ctx.send(f'Failed: {e}')
@@ -2466,11 +3743,13 @@ async def warn_prefix(ctx, member: discord.Member = None, *, reason: str = None)
     if is_protected(ctx.guild.id, member.id):
         return await ctx.send(f"{member.mention} is protected from warnings.")
     key = f'{ctx.guild.id}-{member.id}'
-    if key not in warns:
-        warns[key] = []
-    warn_id = max([w['id'] for w in warns[key]], default=0) + 1
-    warns[key].append({'id': warn_id, 'reason': reason or 'No reason', 'moderator': str(ctx.author.id), 'timestamp': datetime.now().isoformat()})
-    save_data()
+    user_warns = warns.get(ctx.guild.id, member.id)
+    if user_warns is None:
+        user_warns = []
+        warns.set(ctx.guild.id, member.id, user_warns)
+    warn_id = max([w['id'] for w in user_warns], default=0) + 1
+    user_warns.append({'id': warn_id, 'reason': reason or 'No reason', 'moderator': str(ctx.author.id), 'timestamp': datetime.now().isoformat()})
+    save_data('warns', key)
     await ctx.send(f'✅ Warned {member.mention} (Warning #{warn_id})')
 
 @bot.command(name='viewwarns')
@@ -2479,8 +3758,7 @@ async def viewwarns_prefix(ctx, member: discord.Member = None):
         return await ctx.send("You don't have permission.")
     if member is None:
         return await ctx.send('Usage: `?viewwarns <@user>`')
-    key = f'{ctx.guild.id}-{member.id}'
-    user_warns = warns.get(key, [])
+    user_warns = warns.get(ctx.guild.id, member.id, [])
     if not user_warns:
         return await ctx.send(f'{member.mention} has no warnings.')
     msg = f'⚠️ **Warnings for {member.name}**\n'
@@ -2495,11 +3773,12 @@ async def delwarn_prefix(ctx, member: discord.Member = None, warn_id: int = None
     if member is None or warn_id is None:
         return await ctx.send('Usage: `?delwarn <@user> <warn_id>`')
     key = f'{ctx.guild.id}-{member.id}'
-    if key in warns:
-        warns[key] = [w for w in warns[key] if w['id'] != warn_id]
-        if not warns[key]:
-            del warns[key]
-        save_data()
+    user_warns = warns.get(ctx.guild.id, member.id)
+    if user_warns is not None:
+        user_warns[:] = [w for w in user_warns if w['id'] != warn_id]
+        if not user_warns:
+            warns.pop(ctx.guild.id, member.id)
+        save_data('warns', key)
         await ctx.send(f'✅ Deleted warning #{warn_id}')
     else:
         await ctx.send('Warning not found.')
@@ -2539,7 +3818,7 @@ async def addit_prefix(ctx):
         return await ctx.send('You need to be an admin.')
     guild_id = str(ctx.guild.id)
     config['welcome_dm'][guild_id] = not config['welcome_dm'].get(guild_id, False)
-    save_data()
+    save_data('config')
     status = 'enabled' if config['welcome_dm'][guild_id] else 'disabled'
     await ctx.send(f'✅ Welcome DM {status}.')
 
@@ -2632,30 +3911,34 @@ async def pickupline_prefix(ctx):
 @bot.command(name='balance')
 async def balance_prefix(ctx):
     user_data = get_user_balance(ctx.guild.id, ctx.author.id)
-    await ctx.send(f'💰 You have **{user_data["coins"]}** coins!')
+    await ctx.send(f'💰 You have **{user_data.coins}** coins!')
+
+@bot.command(name='economy')
+async def economy_prefix(ctx):
+    await ctx.send(await build_economy_summary(ctx.guild))
 
 @bot.command(name='gamble')
 async def gamble_prefix(ctx, amount: int = None):
     if amount is None or amount <= 0:
         return await ctx.send('Usage: `?gamble <amount>`')
     user_data = get_user_balance(ctx.guild.id, ctx.author.id)
-    if user_data['coins'] < amount:
-        return await ctx.send(f'You need more coins! Balance: **{user_data["coins"]}**')
+    if user_data.coins < amount:
+        return await ctx.send(f'You need more coins! Balance: **{user_data.coins}**')
     if random.random() > 0.5:
-        user_data['coins'] += amount
-        save_data()
-        await ctx.send(f'🎉 You won **{amount}** coins! Balance: **{user_data["coins"]}**')
+        user_data.coins += amount
+        save_data('gambling', f'{ctx.guild.id}-{ctx.author.id}')
+        await ctx.send(f'🎉 You won **{amount}** coins! Balance: **{user_data.coins}**')
     else:
-        user_data['coins'] -= amount
-        save_data()
-        await ctx.send(f'😢 You lost **{amount}** coins! Balance: **{user_data["coins"]}**')
+        user_data.coins -= amount
+        save_data('gambling', f'{ctx.guild.id}-{ctx.author.id}')
+        await ctx.send(f'😢 You lost **{amount}** coins! Balance: **{user_data.coins}**')
 
 @bot.command(name='roulette')
 async def roulette_prefix(ctx, amount: int = None, bet: str = None):
     if amount is None or bet is None:
         return await ctx.send('Usage: `?roulette <amount> <red/black/number>`')
     user_data = get_user_balance(ctx.guild.id, ctx.author.id)
-    if user_data['coins'] < amount:
+    if user_data.coins < amount:
         return await ctx.send(f'Insufficient coins!')
     red_numbers = [1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36]
     winning_number = random.randint(0, 36)
@@ -2663,12 +3946,12 @@ async def roulette_prefix(ctx, amount: int = None, bet: str = None):
     won = (bet == 'red' and winning_color == 'red') or (bet == 'black' and winning_color == 'black') or (bet.isdigit() and int(bet) == winning_number)
     if won:
         winnings = amount * (35 if bet.isdigit() else 2)
-        user_data['coins'] += winnings - amount
-        save_data()
+        user_data.coins += winnings - amount
+        save_data('gambling', f'{ctx.guild.id}-{ctx.author.id}')
         await ctx.send(f'🎰 Ball landed on **{winning_number}** ({winning_color})!\n🎉 You won **{winnings}** coins!')
     else:
-        user_data['coins'] -= amount
-        save_data()
+        user_data.coins -= amount
+        save_data('gambling', f'{ctx.guild.id}-{ctx.author.id}')
         await ctx.send(f'🎰 Ball landed on **{winning_number}** ({winning_color})!\n😢 You lost **{amount}** coins!')
 
 @bot.command(name='shop')
@@ -2682,31 +3965,31 @@ async def buy_prefix(ctx, item: str = None):
         return await ctx.send('Usage: `?buy <item number>`')
     user_data = get_user_balance(ctx.guild.id, ctx.author.id)
     if item == '1':
-        if user_data['coins'] < 5000:
+        if user_data.coins < 5000:
             return await ctx.send('Need 5000 coins!')
-        user_data['coins'] -= 5000
-        save_data()
+        user_data.coins -= 5000
+        save_data('gambling', f'{ctx.guild.id}-{ctx.author.id}')
         await ctx.send('✅ Purchased Custom Role Color!')
     elif item == '3':
-        if user_data['coins'] < 2000:
+        if user_data.coins < 2000:
             return await ctx.send('Need 2000 coins!')
         bonus = random.randint(500, 5000)
-        user_data['coins'] -= 2000 + bonus
-        save_data()
+        user_data.coins -= 2000 + bonus
+        save_data('gambling', f'{ctx.guild.id}-{ctx.author.id}')
         await ctx.send(f'🎁 Got **{bonus}** coins!')
 
 @bot.command(name='daily')
 async def daily_prefix(ctx):
     user_data = get_user_balance(ctx.guild.id, ctx.author.id)
     now = datetime.now().timestamp()
-    if now - user_data['last_daily'] < 86400:
-        time_left = 86400 - (now - user_data['last_daily'])
+    if now - user_data.last_daily < 86400:
+        time_left = 86400 - (now - user_data.last_daily)
         await ctx.send(f'⏰ Come back in {format_duration(int(time_left))}')
     else:
-        user_data['coins'] += 500
-        user_data['last_daily'] = now
-        save_data()
-        await ctx.send(f'🎁 +500 coins! Balance: **{user_data["coins"]}**')
+        user_data.coins += 500
+        user_data.last_daily = now
+        save_data('gambling', f'{ctx.guild.id}-{ctx.author.id}')
+        await ctx.send(f'🎁 +500 coins! Balance: **{user_data.coins}**')
 
 @bot.command(name='poll')
 async def poll_prefix(ctx, *, content: str = None):
@@ -2723,9 +4006,7 @@ async def poll_prefix(ctx, *, content: str = None):
 
 @bot.command(name='afk')
 async def afk_prefix(ctx, *, reason: str = 'AFK'):
-    user_key = f'{ctx.guild.id}-{ctx.author.id}'
-    afk_users[user_key] = {'reason': reason, 'timestamp': datetime.now().timestamp()}
-    save_data()
+    set_afk(ctx.guild.id, ctx.author.id, reason)
     await ctx.send(f'{ctx.author.mention} is now AFK: {reason}')
 
 @bot.command(name='beta')
@@ -2741,7 +4022,7 @@ async def commandban_prefix(ctx, user: discord.User = None, *, reason: str = 'No
         return await ctx.send('Usage: `?commandban <@user> [reason]`')
     key = f'{ctx.guild.id}-{user.id}'
     command_penalties[key] = {'type': 'ban', 'reason': reason, 'timestamp': datetime.now().isoformat()}
-    save_data()
+    save_data('command_penalties', key)
     await ctx.send(f'✅ {user.mention} banned from commands!')
 
 @bot.command(name='commandunban')
@@ -2753,7 +4034,7 @@ async def commandunban_prefix(ctx, user: discord.User = None):
     key = f'{ctx.guild.id}-{user.id}'
     if key in command_penalties:
         del command_penalties[key]
-        save_data()
+        save_data('command_penalties', key)
         await ctx.send(f'✅ {user.mention} unbanned!')
     else:
         await ctx.send('User not banned.')
@@ -2769,7 +4050,8 @@ async def commandmute_prefix(ctx, user: discord.User = None, duration: str = Non
         return await ctx.send('Invalid duration!')
     key = f'{ctx.guild.id}-{user.id}'
     command_penalties[key] = {'type': 'mute', 'end_time': (datetime.now() + timedelta(seconds=seconds)).timestamp(), 'reason': reason}
-    save_data()
+    schedule_expiry('command_penalties', key, command_penalties[key]['end_time'])
+    save_data('command_penalties', key)
     await ctx.send(f'✅ {user.mention} muted for {format_duration(seconds)}!')
 
 @bot.command(name='commandunmute')
@@ -2781,7 +4063,7 @@ async def commandunmute_prefix(ctx, user: discord.User = None):
     key = f'{ctx.guild.id}-{user.id}'
     if key in command_penalties and command_penalties[key].get('type') == 'mute':
         del command_penalties[key]
-        save_data()
+        save_data('command_penalties', key)
         await ctx.send(f'✅ {user.mention} unmuted!')
     else:
         await ctx.send('Not muted.')
@@ -2796,11 +4078,34 @@ async def commandwarn_prefix(ctx, user: discord.User = None, *, reason: str = 'N
     if key not in command_penalties:
         command_penalties[key] = {'type': 'warns', 'count': 0}
     command_penalties[key]['count'] = command_penalties[key].get('count', 0) + 1
-    save_data()
+    save_data('command_penalties', key)
     await ctx.send(f'⚠️ {user.mention} warned! ({command_penalties[key]["count"]} warnings)')
 
+@bot.command(name='perfstats')
+async def perfstats_prefix(ctx):
+    if not is_bot_owner(ctx.author.id):
+        return await ctx.send('Only bot owner!')
+    await ctx.send(format_perf_stats())
+
 
 # Giveaway Commands
+class GiveawayEntryView(ui.View):
+    # One persistent view serves every giveaway message; the message ID
+    # identifies the giveaway
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    @ui.button(label='Enter', style=discord.ButtonStyle.primary, emoji='🎉', custom_id='giveaway:enter')
+    async def enter_button(self, interaction: discord.Interaction, button: ui.Button):
+        giveaway_id = str(interaction.message.id)
+        giveaway_data = giveaways.get(giveaway_id)
+        if not giveaway_data or giveaway_data.get('ended', False) or not giveaway_data.get('entry_button'):
+            return await interaction.response.send_message('This giveaway has ended!', ephemeral=True)
+
+        if not enter_giveaway(giveaway_id, interaction.user.id):
+            return await interaction.response.send_message('You have already entered this giveaway!', ephemeral=True)
+        await interaction.response.send_message(f'🎉 You have entered the giveaway for **{giveaway_data["prize"]}**! ({giveaway_entrants.count(giveaway_id)} entries)', ephemeral=True)
+
 giveaway_group = app_commands.Group(name='giveaway', description='Giveaway management commands')
 
 @giveaway_group.command(name='create', description='Create a giveaway (Admin+)')
@@ -2808,9 +4113,18 @@ giveaway_group = app_commands.Group(name='giveaway', description='Giveaway manag
     duration='Duration (e.g., 1h, 2d, 1w)',
     winners='Number of winners',
     prize='Prize description',
-    channel='Channel to post the giveaway in'
+    channel='Channel to post the giveaway in',
+    weighting='Give members more entries by level, coins or role',
+    role_weights='Role multipliers for role weighting, e.g. @VIP=3 @Booster=2'
 )
-async def giveaway_create(interaction: discord.Interaction, duration: str, winners: int, prize: str, channel: discord.TextChannel):
+@app_commands.choices(weighting=[
+    app_commands.Choice(name='Even (no weighting)', value='none'),
+    app_commands.Choice(name='Level', value='level'),
+    app_commands.Choice(name='Coins', value='coins'),
+    app_commands.Choice(name='Roles', value='roles')
+])
+async def giveaway_create(interaction: discord.Interaction, duration: str, winners: int, prize: str, channel: discord.TextChannel,
+                          weighting: app_commands.Choice[str] = None, role_weights: str = None):
     if not interaction.guild:
         return await interaction.response.send_message('This command can only be used in a server.', ephemeral=True)
     if not is_admin(interaction.guild.id, interaction.user.id):
@@ -2823,14 +4137,25 @@ async def giveaway_create(interaction: discord.Interaction, duration: str, winne
     if not duration_seconds:
         return await interaction.response.send_message('Invalid duration format. Examples: `1h`, `2d`, `1w`', ephemeral=True)
 
+    weighting = weighting.value if weighting else 'none'
+    multipliers = parse_role_weights(role_weights)
+    if weighting == 'roles' and not multipliers:
+        return await interaction.response.send_message('Role weighting needs role multipliers, e.g. `@VIP=3 @Booster=2`', ephemeral=True)
+
     end_time = datetime.now() + timedelta(seconds=duration_seconds)
 
+    weighting_text = {
+        'level': 'Higher levels get more entries\n',
+        'coins': 'More coins get more entries\n',
+        'roles': ''.join(f'<@&{role_id}> x{multiplier:g} entries\n' for role_id, multiplier in multipliers.items())
+    }.get(weighting, '')
     embed = discord.Embed(
         title='🎉 GIVEAWAY 🎉',
         description=f'**Prize:** {prize}\n\n'
                     f'**Winners:** {winners}\n'
                     f'**Hosted by:** {interaction.user.mention}\n\n'
-                    f'React with 🎉 to enter!',
+                    f'{weighting_text}'
+                    f'Click **Enter** to join!',
         color=0xFF00FF
     )
     embed.set_footer(text=f'Ends at')
@@ -2838,8 +4163,7 @@ async def giveaway_create(interaction: discord.Interaction, duration: str, winne
 
     await interaction.response.send_message(f'✅ Giveaway created in {channel.mention}!', ephemeral=True)
 
-    message = await channel.send(embed=embed)
-    await message.add_reaction('🎉')
+    message = await channel.send(embed=embed, view=GiveawayEntryView())
 
     giveaways[str(message.id)] = {
         'guild_id': str(interaction.guild.id),
@@ -2848,9 +4172,14 @@ async def giveaway_create(interaction: discord.Interaction, duration: str, winne
         'winners': winners,
         'host_id': str(interaction.user.id),
         'end_time': end_time.timestamp(),
-        'ended': False
+        'ended': False,
+        'entry_button': True,
+        'weighting': weighting
     }
-    save_data()
+    if weighting == 'roles':
+        giveaways[str(message.id)]['role_weights'] = multipliers
+    schedule_expiry('giveaways', str(message.id), end_time.timestamp())
+    save_data('giveaways', str(message.id))
 
 @giveaway_group.command(name='end', description='End a giveaway early (Admin+)')
 @app_commands.describe(message_id='The message ID of the giveaway')
@@ -2873,46 +4202,11 @@ async def giveaway_end(interaction: discord.Interaction, message_id: str):
         if not channel or not isinstance(channel, (discord.TextChannel, discord.Thread)):
             return await interaction.response.send_message('Giveaway channel not found!', ephemeral=True)
 
-        message = await channel.fetch_message(int(message_id))
-
-        reaction = discord.utils.get(message.reactions, emoji='🎉')
-        if not reaction:
-            giveaways[message_id]['ended'] = True
-            save_data()
-            await interaction.response.send_message('❌ No participants in this giveaway!', ephemeral=True)
-            return
-
-        participants = []
-        async for user in reaction.users():
-            if not user.bot:
-                participants.append(user)
-
-        if len(participants) == 0:
-            giveaways[message_id]['ended'] = True
-            save_data()
-            await interaction.response.send_message('❌ No valid participants in this giveaway!', ephemeral=True)
-            return
-
-        num_winners = min(giveaway_data['winners'], len(participants))
-        winners = random.sample(participants, num_winners)
-
-        winner_mentions = ', '.join([winner.mention for winner in winners])
-
-        embed = discord.Embed(
-            title='🎉 Giveaway Ended!',
-            description=f'**Prize:** {giveaway_data["prize"]}',
-            color=0x00FF00
-        )
-        embed.add_field(name='Winners', value=winner_mentions, inline=False)
-        embed.set_footer(text=f'Ended early by {interaction.user.name}')
-        embed.timestamp = datetime.utcnow()
-
-        await message.edit(embed=embed)
-        await channel.send(f'🎊 Congratulations {winner_mentions}! You won **{giveaway_data["prize"]}**!')
-
-        giveaways[message_id]['ended'] = True
-        giveaways[message_id]['winners_list'] = [str(w.id) for w in winners]
-        save_data()
+        winners = await finish_giveaway(message_id, channel, f'Ended early by {interaction.user.name}')
+        if winners is None:
+            return await interaction.response.send_message('The giveaway message no longer exists!', ephemeral=True)
+        if not winners:
+            return await interaction.response.send_message('❌ No participants in this giveaway!', ephemeral=True)
 
         await interaction.response.send_message('✅ Giveaway ended successfully!', ephemeral=True)
 
@@ -2940,31 +4234,25 @@ async def giveaway_reroll(interaction: discord.Interaction, message_id: str):
         if not channel or not isinstance(channel, (discord.TextChannel, discord.Thread)):
             return await interaction.response.send_message('Giveaway channel not found!', ephemeral=True)
 
-        message = await channel.fetch_message(int(message_id))
-
-        reaction = discord.utils.get(message.reactions, emoji='🎉')
-        if not reaction:
-            return await interaction.response.send_message('❌ No participants to reroll!', ephemeral=True)
-
-        participants = []
-        previous_winners = giveaway_data.get('winners_list', [])
-
-        async for user in reaction.users():
-            if not user.bot and str(user.id) not in previous_winners:
-                participants.append(user)
-
-        if len(participants) == 0:
+        if giveaway_data.get('entry_button'):
+            entrants = giveaway_entrants.get(message_id)
+        else:
+            message = await channel.fetch_message(int(message_id))
+            entrants = await fetch_reaction_entrants(message)
+
+        previous_winners = {int(user_id) for user_id in giveaway_data.get('winners_list', [])}
+        weights = giveaway_weights(giveaway_data, entrants)
+        new_winners = draw_winners(entrants, giveaway_data['winners'], previous_winners, weights)
+        giveaway_entrants.drop(message_id)
+        if not new_winners:
             return await interaction.response.send_message('❌ No new participants available for reroll!', ephemeral=True)
 
-        num_winners = min(giveaway_data['winners'], len(participants))
-        new_winners = random.sample(participants, num_winners)
-
-        winner_mentions = ', '.join([winner.mention for winner in new_winners])
+        winner_mentions = ', '.join(f'<@{user_id}>' for user_id in new_winners)
 
         await channel.send(f'🔄 **Giveaway Rerolled!**\n🎊 New winner(s): {winner_mentions} for **{giveaway_data["prize"]}**!')
 
-        giveaways[message_id]['winners_list'].extend([str(w.id) for w in new_winners])
-        save_data()
+        giveaways[message_id].setdefault('winners_list', []).extend(str(user_id) for user_id in new_winners)
+        save_data('giveaways', message_id)
 
         await interaction.response.send_message('✅ Giveaway rerolled successfully!', ephemeral=True)
 
@@ -3004,11 +4292,21 @@ bot.tree.add_command(giveaway_group)
 
 
 if __name__ == '__main__':
+    mark_startup_phase('imports')
     load_data()
+    mark_startup_phase('data load')
 
     token = os.getenv('DISCORD_BOT_TOKEN')
     if not token:
         print('ERROR: DISCORD_BOT_TOKEN environment variable is not set!')
         exit(1)
 
-    bot.run(token)
\ No newline at end of file
+    bot.run(token)
+
+    # Write out whatever the commit and flush loops had not persisted yet
+    commit_pending_xp()
+    persist_finished_giveaways()
+    flush_dirty_stores_sync()
+    storage_backend.close()
+    if LEVELS_FILE:
+        levels.close()
\ No newline at end of file
@@ -0,0 +1,261 @@
+# Column-oriented alternative to members.MemberMap for the numeric member
+# stores. Each guild keeps its user IDs in a sorted array('q') with one
+# array per numeric field alongside it, so a member costs a few machine
+# words instead of a Python object. Fields without a typecode (such as a
+# balance's item list) are kept in a sparse per-guild dict.
+
+import json
+from array import array
+from bisect import bisect_left
+import heapq
+
+from members import split_key
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class GuildColumns:
+    def __init__(self, fields):
+        self.ids = array('q')
+        self.arrays = {name: array(typecode) for name, typecode, _ in fields if typecode}
+        self.objects = {name: {} for name, typecode, _ in fields if not typecode}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find(self, user_id):
+        i = bisect_left(self.ids, user_id)
+        if i < len(self.ids) and self.ids[i] == user_id:
+            return i
+        return None
+
+
+class ColumnRow:
+    # Rows look like the record objects of members.py, but read and write
+    # the columns directly. They look the member up on every access, so a
+    # row stays valid while other members are added or removed.
+    __slots__ = ('columns', 'user_id')
+
+    def __init__(self, columns, user_id):
+        self.columns = columns
+        self.user_id = user_id
+
+
+def make_row_class(fields):
+    def column_property(name):
+        def get(self):
+            return self.columns.arrays[name][self.columns.find(self.user_id)]
+
+        def set(self, value):
+            self.columns.arrays[name][self.columns.find(self.user_id)] = value
+        return property(get, set)
+
+    def object_property(name, default):
+        def get(self):
+            values = self.columns.objects[name]
+            if self.user_id not in values:
+                values[self.user_id] = default()
+            return values[self.user_id]
+
+        def set(self, value):
+            self.columns.objects[name][self.user_id] = value
+        return property(get, set)
+
+    namespace = {'__slots__': ()}
+    for name, typecode, default in fields:
+        namespace[name] = column_property(name) if typecode else object_property(name, default)
+    return type('ColumnRow', (ColumnRow,), namespace)
+
+
+class ColumnStore:
+    # record is a members.py record class with a `columns` attribute of
+    # (name, typecode, default) fields; typecode None marks an object field
+    # whose default is a factory.
+    def __init__(self, record):
+        self.record = record
+        self.fields = record.columns
+        self.row_class = make_row_class(self.fields)
+        self.guilds = {}
+
+    def __len__(self):
+        return sum(len(columns) for columns in self.guilds.values())
+
+    def get(self, guild_id, user_id, default=None):
+        columns = self.guilds.get(guild_id)
+        if columns is None or columns.find(user_id) is None:
+            return default
+        return self.row_class(columns, user_id)
+
+    def set(self, guild_id, user_id, value):
+        columns = self.guilds.get(guild_id)
+        if columns is None:
+            columns = self.guilds[guild_id] = GuildColumns(self.fields)
+
+        i = columns.find(user_id)
+        if i is None:
+            i = bisect_left(columns.ids, user_id)
+            columns.ids.insert(i, user_id)
+            for name, values in columns.arrays.items():
+                values.insert(i, getattr(value, name))
+        else:
+            for name, values in columns.arrays.items():
+                values[i] = getattr(value, name)
+        for name, values in columns.objects.items():
+            values[user_id] = getattr(value, name)
+
+    def pop(self, guild_id, user_id, default=None):
+        columns = self.guilds.get(guild_id)
+        i = columns.find(user_id) if columns is not None else None
+        if i is None:
+            return default
+
+        value = self.to_record(self.row_class(columns, user_id))
+        del columns.ids[i]
+        for values in columns.arrays.values():
+            del values[i]
+        for values in columns.objects.values():
+            values.pop(user_id, None)
+        if not columns.ids:
+            del self.guilds[guild_id]
+        return value
+
+    def guild_ids(self):
+        return list(self.guilds)
+
+    def count(self, guild_id):
+        columns = self.guilds.get(guild_id)
+        return len(columns) if columns is not None else 0
+
+    def items(self):
+        for guild_id, columns in self.guilds.items():
+            for user_id in columns.ids:
+                yield guild_id, user_id, self.row_class(columns, user_id)
+
+    def pairs(self, guild_id, name):
+        columns = self.guilds.get(guild_id)
+        if columns is None:
+            return []
+        return zip(columns.ids, columns.arrays[name])
+
+    # Bulk operations over one guild's column
+
+    def total(self, guild_id, name):
+        columns = self.guilds.get(guild_id)
+        if columns is None:
+            return 0
+        values = columns.arrays[name]
+        if numpy is not None and values:
+            return numpy.frombuffer(values, dtype=values.typecode).sum().item()
+        return sum(values)
+
+    def top(self, guild_id, name, count):
+        # (user_id, value) pairs, highest value first
+        columns = self.guilds.get(guild_id)
+        if columns is None:
+            return []
+        values = columns.arrays[name]
+        if numpy is not None and len(values) > count:
+            view = numpy.frombuffer(values, dtype=values.typecode)
+            best = numpy.argpartition(view, -count)[-count:]
+            best = best[numpy.argsort(view[best])[::-1]]
+            return [(columns.ids[i], values[i]) for i in best.tolist()]
+        return heapq.nlargest(count, zip(columns.ids, values), key=lambda pair: pair[1])
+
+    def reset(self, guild_id, name, value):
+        # One new column instead of a write per member
+        columns = self.guilds.get(guild_id)
+        if columns is None:
+            return
+        values = columns.arrays[name]
+        columns.arrays[name] = array(values.typecode, [value]) * len(values)
+
+    # Persistence boundary, same as members.MemberMap
+
+    def to_record(self, row):
+        return self.record(**{name: getattr(row, name) for name, _, _ in self.fields})
+
+    def to_value(self, row):
+        return self.to_record(row).to_dict()
+
+    def store_value(self, key):
+        row = self.get(*split_key(key))
+        return None if row is None else self.to_value(row)
+
+    def to_store(self):
+        return {f'{guild_id}-{user_id}': self.to_value(row) for guild_id, user_id, row in self.items()}
+
+    @classmethod
+    def from_store(cls, data, record):
+        # Builds each guild's columns in one pass instead of inserting
+        # members one at a time
+        store = cls(record)
+        members = {}
+        for key, value in (data or {}).items():
+            guild_id, user_id = split_key(key)
+            members.setdefault(guild_id, []).append((user_id, record.from_dict(value)))
+
+        for guild_id, rows in members.items():
+            rows.sort(key=lambda row: row[0])
+            columns = store.guilds[guild_id] = GuildColumns(store.fields)
+            columns.ids = array('q', (user_id for user_id, _ in rows))
+            for name in columns.arrays:
+                columns.arrays[name] = array(columns.arrays[name].typecode, (getattr(value, name) for _, value in rows))
+            for name, values in columns.objects.items():
+                values.update((user_id, getattr(value, name)) for user_id, value in rows)
+        return store
+
+    # Raw snapshots: a JSON header line followed by each guild's buffers
+
+    def dump(self, path):
+        header = {'fields': [name for name, typecode, _ in self.fields if typecode], 'guilds': []}
+        buffers = []
+        for guild_id, columns in self.guilds.items():
+            header['guilds'].append({
+                'id': guild_id,
+                'count': len(columns.ids),
+                'objects': {name: {str(k): v for k, v in values.items()} for name, values in columns.objects.items()}
+            })
+            buffers.append(columns.ids.tobytes())
+            buffers.extend(columns.arrays[name].tobytes() for name in header['fields'])
+
+        with open(path, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            for buffer in buffers:
+                f.write(buffer)
+
+    @classmethod
+    def load_dump(cls, path, record):
+        store = cls(record)
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            for guild in header['guilds']:
+                columns = store.guilds[guild['id']] = GuildColumns(store.fields)
+                columns.ids.fromfile(f, guild['count'])
+                for name in header['fields']:
+                    columns.arrays[name].fromfile(f, guild['count'])
+                for name, values in guild['objects'].items():
+                    columns.objects[name] = {int(k): v for k, v in values.items()}
+        return store
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+
+    import storage
+    from members import Balance, LevelEntry
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'dump':
+        print('Usage: python columns.py dump [data_dir]')
+        sys.exit(1)
+
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else 'data'
+    backend = storage.JSONBackend(data_dir, journal=True)
+    for name, record in (('levels', LevelEntry), ('gambling', Balance)):
+        store = ColumnStore.from_store(backend.load(name, compact=False), record)
+        path = os.path.join(data_dir, f'{name}.columns')
+        store.dump(path)
+        print(f'Wrote {len(store)} members to {path}')
@@ -0,0 +1,119 @@
+# Entrants of button giveaways. Each giveaway has <directory>/<id>.bin, an
+# append-only file of int64 user IDs, so an entry costs eight bytes on disk
+# however many people have entered before. In memory a giveaway keeps its
+# entrants once in an array('q') for drawing winners, plus a set to turn
+# away repeat entries. Giveaways are read from their file the first time
+# they are used and can be dropped again once they have ended.
+#
+# An EntrantLog persists itself like partitions.PartitionedStore: bot.py
+# hands it the dirty giveaway IDs through prepare()/write(), and only the
+# entries added since the last write are appended.
+
+import os
+from array import array
+from pathlib import Path
+
+RECORD_SIZE = array('q').itemsize
+
+
+class Entrants:
+    __slots__ = ('ids', 'seen', 'written')
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.seen = set(ids)
+        # How many of ids are on disk
+        self.written = len(ids)
+
+
+class EntrantLog:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # giveaway_id -> Entrants
+        self.giveaways = {}
+        # Dropped giveaways that still had entries to write
+        self.closed = set()
+
+    def path(self, giveaway_id):
+        return self.directory / f'{giveaway_id}.bin'
+
+    def load(self, giveaway_id):
+        entrants = self.giveaways.get(giveaway_id)
+        if entrants is not None:
+            return entrants
+
+        ids = array('q')
+        try:
+            with open(self.path(giveaway_id), 'rb') as f:
+                data = f.read()
+            # A record cut short by a crash is dropped
+            ids.frombytes(data[:len(data) - len(data) % RECORD_SIZE])
+        except FileNotFoundError:
+            pass
+        entrants = self.giveaways[giveaway_id] = Entrants(ids)
+        return entrants
+
+    def get(self, giveaway_id):
+        return self.load(giveaway_id).ids
+
+    def add(self, giveaway_id, user_id):
+        # Returns False if the user had already entered
+        entrants = self.load(giveaway_id)
+        if user_id in entrants.seen:
+            return False
+        entrants.seen.add(user_id)
+        entrants.ids.append(user_id)
+        return True
+
+    def count(self, giveaway_id):
+        return len(self.load(giveaway_id).ids)
+
+    def drop(self, giveaway_id):
+        # Frees the memory of a giveaway that has ended, once its entries
+        # are on disk
+        self.closed.add(giveaway_id)
+        self.sweep()
+
+    def sweep(self):
+        for giveaway_id in list(self.closed):
+            entrants = self.giveaways.get(giveaway_id)
+            if entrants is None or entrants.written == len(entrants.ids):
+                self.giveaways.pop(giveaway_id, None)
+                self.closed.discard(giveaway_id)
+
+    def import_list(self, giveaway_id, user_ids):
+        # Converts a giveaway whose entrants were kept in its record
+        entrants = self.load(giveaway_id)
+        for user_id in user_ids:
+            if user_id not in entrants.seen:
+                entrants.seen.add(user_id)
+                entrants.ids.append(user_id)
+
+    # Persistence, called like a storage backend. Each payload carries the
+    # record offset it starts at, so a write that is retried after failing
+    # overwrites its own partial records instead of appending them twice.
+
+    def prepare(self, name, data, keys):
+        self.sweep()
+        giveaway_ids = self.giveaways if keys is None else keys
+        payload = {}
+        for giveaway_id in giveaway_ids:
+            entrants = self.giveaways.get(giveaway_id)
+            if entrants is None or entrants.written == len(entrants.ids):
+                continue
+            payload[giveaway_id] = (entrants.written, entrants.ids[entrants.written:].tobytes())
+        return payload
+
+    def write(self, name, payload):
+        for giveaway_id, (start, data) in payload.items():
+            path = self.path(giveaway_id)
+            with open(path, 'r+b' if path.exists() else 'wb') as f:
+                f.seek(start * RECORD_SIZE)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+            entrants = self.giveaways.get(giveaway_id)
+            if entrants is not None:
+                entrants.written = max(entrants.written, start + len(data) // RECORD_SIZE)
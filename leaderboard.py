@@ -0,0 +1,100 @@
+# Per-guild XP rankings kept in sorted order as XP changes, so leaderboards
+# and rank lookups never have to scan or sort the whole levels store.
+
+from bisect import bisect_left, bisect_right
+
+
+class GuildRanking:
+    # keys holds -xp in ascending order (highest XP first) and users the
+    # matching user IDs. Members with equal XP are in no particular order,
+    # which lets the common +1 XP bump swap two slots instead of shifting.
+    def __init__(self, items=()):
+        pairs = sorted(((-xp, user_id) for user_id, xp in items))
+        self.keys = [key for key, _ in pairs]
+        self.users = [user_id for _, user_id in pairs]
+        self.pos = {user_id: i for i, user_id in enumerate(self.users)}
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return user_id in self.pos
+
+    def _reindex(self, start, end):
+        for i in range(start, end):
+            self.pos[self.users[i]] = i
+
+    def _swap(self, i, j):
+        self.users[i], self.users[j] = self.users[j], self.users[i]
+        self.pos[self.users[i]] = i
+        self.pos[self.users[j]] = j
+
+    def update(self, user_id, xp):
+        key = -xp
+        i = self.pos.get(user_id)
+
+        if i is None:
+            t = bisect_right(self.keys, key)
+            self.keys.insert(t, key)
+            self.users.insert(t, user_id)
+            self._reindex(t, len(self.users))
+            return
+
+        old = self.keys[i]
+        if key == old:
+            return
+
+        if key < old:
+            # Moving up: lands after everyone who now has at least as much XP
+            t = bisect_right(self.keys, key, 0, i)
+            if self.keys[t] == old:
+                # Only members tied with the old XP are passed
+                self._swap(t, i)
+                self.keys[t] = key
+                return
+            start, end = t, i + 1
+        else:
+            # Moving down: lands before everyone who now has less XP
+            t = bisect_left(self.keys, key, i + 1) - 1
+            if self.keys[t] == old:
+                self._swap(i, t)
+                self.keys[t] = key
+                return
+            start, end = i, t + 1
+
+        del self.keys[i]
+        del self.users[i]
+        self.keys.insert(t, key)
+        self.users.insert(t, user_id)
+        self._reindex(start, end)
+
+    def remove(self, user_id):
+        i = self.pos.pop(user_id, None)
+        if i is None:
+            return
+        del self.keys[i]
+        del self.users[i]
+        self._reindex(i, len(self.users))
+
+    def top(self, count, offset=0):
+        end = min(offset + count, len(self.users))
+        return [(self.users[i], -self.keys[i]) for i in range(offset, end)]
+
+    def get_xp(self, user_id):
+        i = self.pos.get(user_id)
+        return None if i is None else -self.keys[i]
+
+    def next_above(self, xp):
+        # (xp, rank) of the closest group with more XP, or None at the top
+        i = bisect_left(self.keys, -xp)
+        if i == 0:
+            return None
+        key = self.keys[i - 1]
+        return -key, bisect_left(self.keys, key) + 1
+
+    def rank(self, user_id):
+        # 1-based rank; members with equal XP share a rank
+        i = self.pos.get(user_id)
+        if i is None:
+            return None
+        return bisect_left(self.keys, self.keys[i]) + 1
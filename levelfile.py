@@ -0,0 +1,211 @@
+# Memory-mapped levels store. levels.bin is a 16 byte header followed by
+# fixed-size (guild_id, user_id, xp) records, so changing a member's XP is
+# an in-place write of eight bytes that the OS flushes to disk on its own.
+# Opening the file only scans the records to build the in-memory index;
+# there is no JSON to parse and nothing to save afterwards.
+
+import heapq
+import mmap
+import os
+import struct
+import sys
+
+from members import LevelEntry, split_key
+
+MAGIC = b'BLVL'
+VERSION = 1
+HEADER = struct.Struct('<4sIQ')  # magic, version, record count
+RECORD = struct.Struct('<qqq')   # guild_id, user_id, xp
+XP = struct.Struct('<q')
+XP_OFFSET = 16
+MIN_CAPACITY = 1024
+
+
+class LevelRow:
+    # Same attributes as members.LevelEntry, read from and written to the
+    # mapped file. The slot is looked up on every access because removing
+    # a member moves the last record into its place.
+    __slots__ = ('file', 'guild_id', 'user_id')
+
+    def __init__(self, file, guild_id, user_id):
+        self.file = file
+        self.guild_id = guild_id
+        self.user_id = user_id
+
+    @property
+    def xp(self):
+        return self.file.read_xp(self.file.index[self.guild_id][self.user_id])
+
+    @xp.setter
+    def xp(self, value):
+        self.file.write_xp(self.file.index[self.guild_id][self.user_id], value)
+
+
+class LevelFile:
+    def __init__(self, path, fd, mm):
+        self.path = path
+        self.fd = fd
+        self.mm = mm
+        magic, version, self.size = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} levels file')
+
+        # guild_id -> {user_id: slot}
+        self.index = {}
+        end = HEADER.size + self.size * RECORD.size
+        for slot, (guild_id, user_id, _) in enumerate(RECORD.iter_unpack(mm[HEADER.size:end])):
+            members = self.index.get(guild_id)
+            if members is None:
+                members = self.index[guild_id] = {}
+            members[user_id] = slot
+
+    @classmethod
+    def open(cls, path):
+        if not os.path.exists(path):
+            cls.write_records(path, [])
+        fd = os.open(path, os.O_RDWR)
+        return cls(path, fd, mmap.mmap(fd, 0))
+
+    @classmethod
+    def write_records(cls, path, records):
+        capacity = max(MIN_CAPACITY, len(records))
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+            f.write(b''.join(RECORD.pack(*record) for record in records))
+            f.truncate(HEADER.size + capacity * RECORD.size)
+        os.replace(tmp_path, path)
+
+    # Converters for the JSON levels store
+
+    @classmethod
+    def from_store(cls, path, data):
+        records = [split_key(key) + (value['xp'],) for key, value in (data or {}).items()]
+        cls.write_records(path, records)
+        return cls.open(path)
+
+    def to_store(self):
+        return {f'{guild_id}-{user_id}': {'xp': row.xp} for guild_id, user_id, row in self.items()}
+
+    def store_value(self, key):
+        row = self.get(*split_key(key))
+        return None if row is None else {'xp': row.xp}
+
+    # Record access
+
+    def offset(self, slot):
+        return HEADER.size + slot * RECORD.size
+
+    def read_xp(self, slot):
+        return XP.unpack_from(self.mm, self.offset(slot) + XP_OFFSET)[0]
+
+    def write_xp(self, slot, xp):
+        XP.pack_into(self.mm, self.offset(slot) + XP_OFFSET, xp)
+
+    def set_size(self, size):
+        self.size = size
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, size)
+
+    # Same interface as members.MemberMap for LevelEntry records
+
+    def __len__(self):
+        return self.size
+
+    def get(self, guild_id, user_id, default=None):
+        members = self.index.get(guild_id)
+        if members is None or user_id not in members:
+            return default
+        return LevelRow(self, guild_id, user_id)
+
+    def set(self, guild_id, user_id, value):
+        members = self.index.get(guild_id)
+        if members is None:
+            members = self.index[guild_id] = {}
+
+        slot = members.get(user_id)
+        if slot is not None:
+            self.write_xp(slot, value.xp)
+            return
+
+        slot = self.size
+        if self.offset(slot + 1) > len(self.mm):
+            self.mm.resize(self.offset(max(MIN_CAPACITY, slot * 2)))
+        RECORD.pack_into(self.mm, self.offset(slot), guild_id, user_id, value.xp)
+        members[user_id] = slot
+        self.set_size(slot + 1)
+
+    def pop(self, guild_id, user_id, default=None):
+        members = self.index.get(guild_id)
+        if members is None or user_id not in members:
+            return default
+
+        slot = members.pop(user_id)
+        value = LevelEntry(self.read_xp(slot))
+        if not members:
+            del self.index[guild_id]
+
+        # Keep the records packed by moving the last one into the gap
+        last = self.size - 1
+        if slot != last:
+            record = RECORD.unpack_from(self.mm, self.offset(last))
+            RECORD.pack_into(self.mm, self.offset(slot), *record)
+            self.index[record[0]][record[1]] = slot
+        self.set_size(last)
+        return value
+
+    def guild_ids(self):
+        return list(self.index)
+
+    def count(self, guild_id):
+        return len(self.index.get(guild_id, {}))
+
+    def items(self):
+        for guild_id, members in self.index.items():
+            for user_id in members:
+                yield guild_id, user_id, LevelRow(self, guild_id, user_id)
+
+    def pairs(self, guild_id, name):
+        # xp is the only field
+        return ((user_id, self.read_xp(slot)) for user_id, slot in self.index.get(guild_id, {}).items())
+
+    def total(self, guild_id, name):
+        return sum(xp for _, xp in self.pairs(guild_id, name))
+
+    def top(self, guild_id, name, count):
+        return heapq.nlargest(count, self.pairs(guild_id, name), key=lambda pair: pair[1])
+
+    def reset(self, guild_id, name, value):
+        for slot in self.index.get(guild_id, {}).values():
+            self.write_xp(slot, value)
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        os.close(self.fd)
+
+
+if __name__ == '__main__':
+    import storage
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('import', 'export'):
+        print('Usage: python levelfile.py import|export [data_dir]')
+        sys.exit(1)
+
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else 'data'
+    path = os.path.join(data_dir, 'levels.bin')
+    backend = storage.JSONBackend(data_dir, journal=True)
+
+    if sys.argv[1] == 'import':
+        levels = LevelFile.from_store(path, backend.load('levels', compact=False))
+        print(f'Wrote {len(levels)} members to {path}')
+    else:
+        levels = LevelFile.open(path)
+        # Compacting also clears the journal, whose records would
+        # otherwise be replayed over the exported XP
+        backend.compact(levels.to_store())
+        print(f'Wrote {len(levels)} members to {backend.path("levels")}')
+    levels.close()
+    backend.close()
@@ -0,0 +1,150 @@
+import heapq
+
+# In-memory shape of the per-member stores. Records live in nested
+# {guild_id: {user_id: record}} maps with int keys and slotted record
+# objects; the 'guild-user' keys and plain dicts of the data files only
+# appear at the persistence boundary (to_store, from_store, store_value).
+
+
+class LevelEntry:
+    __slots__ = ('xp',)
+    # (name, array typecode, default) for columns.ColumnStore
+    columns = (('xp', 'q', 0),)
+
+    def __init__(self, xp=0):
+        self.xp = xp
+
+    def to_dict(self):
+        return {'xp': self.xp}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['xp'])
+
+
+class Balance:
+    __slots__ = ('coins', 'last_daily', 'items')
+    columns = (('coins', 'q', 1000), ('last_daily', 'd', 0), ('items', None, list))
+
+    def __init__(self, coins=1000, last_daily=0, items=None):
+        self.coins = coins
+        self.last_daily = last_daily
+        self.items = items if items is not None else []
+
+    def to_dict(self):
+        return {'coins': self.coins, 'last_daily': self.last_daily, 'items': list(self.items)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['coins'], data.get('last_daily', 0), data.get('items', []))
+
+
+class Protection:
+    __slots__ = ('end_time', 'infinite', 'timestamp')
+
+    def __init__(self, end_time=None, infinite=False, timestamp=None):
+        self.end_time = end_time
+        self.infinite = infinite
+        self.timestamp = timestamp
+
+    def is_active(self, now):
+        return self.infinite or self.end_time > now
+
+    def to_dict(self):
+        data = {'infinite': self.infinite, 'timestamp': self.timestamp}
+        if self.end_time is not None:
+            data['end_time'] = self.end_time
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('end_time'), data.get('infinite', False), data.get('timestamp'))
+
+
+def copy_json(value):
+    # Deep copy of plain JSON data (dicts, lists and scalars), for handing
+    # a store to a worker thread while the event loop keeps changing it
+    if isinstance(value, dict):
+        return {k: copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_json(v) for v in value]
+    return value
+
+
+def split_key(key):
+    guild_id, user_id = key.split('-')
+    return int(guild_id), int(user_id)
+
+
+class MemberMap:
+    # record is the class stored for each member, or None to keep the
+    # loaded values (e.g. warning lists) as they are
+    def __init__(self, record=None):
+        self.record = record
+        self.guilds = {}
+
+    def __len__(self):
+        return sum(len(members) for members in self.guilds.values())
+
+    def get(self, guild_id, user_id, default=None):
+        members = self.guilds.get(guild_id)
+        if members is None:
+            return default
+        return members.get(user_id, default)
+
+    def set(self, guild_id, user_id, value):
+        members = self.guilds.get(guild_id)
+        if members is None:
+            members = self.guilds[guild_id] = {}
+        members[user_id] = value
+
+    def pop(self, guild_id, user_id, default=None):
+        members = self.guilds.get(guild_id)
+        if members is None:
+            return default
+        value = members.pop(user_id, default)
+        if not members:
+            del self.guilds[guild_id]
+        return value
+
+    def guild_ids(self):
+        return list(self.guilds)
+
+    def count(self, guild_id):
+        return len(self.guilds.get(guild_id, {}))
+
+    def items(self):
+        for guild_id, members in self.guilds.items():
+            for user_id, value in members.items():
+                yield guild_id, user_id, value
+
+    def pairs(self, guild_id, name):
+        return ((user_id, getattr(value, name)) for user_id, value in self.guilds.get(guild_id, {}).items())
+
+    def total(self, guild_id, name):
+        return sum(value for _, value in self.pairs(guild_id, name))
+
+    def top(self, guild_id, name, count):
+        return heapq.nlargest(count, self.pairs(guild_id, name), key=lambda pair: pair[1])
+
+    def reset(self, guild_id, name, value):
+        for record in self.guilds.get(guild_id, {}).values():
+            setattr(record, name, value)
+
+    def to_value(self, value):
+        return copy_json(value) if self.record is None else value.to_dict()
+
+    def store_value(self, key):
+        value = self.get(*split_key(key))
+        return None if value is None else self.to_value(value)
+
+    def to_store(self):
+        return {f'{guild_id}-{user_id}': self.to_value(value) for guild_id, user_id, value in self.items()}
+
+    @classmethod
+    def from_store(cls, data, record=None):
+        members = cls(record)
+        for key, value in (data or {}).items():
+            guild_id, user_id = split_key(key)
+            members.set(guild_id, user_id, value if record is None else record.from_dict(value))
+        return members
@@ -0,0 +1,155 @@
+# Per-guild partitions for the member stores. Each guild's members live in
+# <directory>/<guild_id>.json and are read the first time the guild is
+# touched, so startup and memory scale with the guilds that are active
+# rather than every guild the bot has ever seen. evict() drops guilds that
+# have gone idle.
+#
+# A PartitionedStore persists itself: bot.py hands it the dirty keys through
+# the same prepare()/write() calls it makes on the storage backend, and only
+# the dirty guilds' files are rewritten.
+
+import heapq
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from members import copy_json, split_key
+
+
+class PartitionedStore:
+    # record is the class stored for each member, or None to keep the
+    # loaded values as they are (same as members.MemberMap). on_load and
+    # on_evict are called with the guild ID after a guild is read or dropped.
+    def __init__(self, directory, record=None, on_load=None, on_evict=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.record = record
+        self.on_load = on_load
+        self.on_evict = on_evict
+        # guild_id -> {user_id: value}, least recently used first
+        self.guilds = OrderedDict()
+        self.last_used = {}
+
+    def path(self, guild_id):
+        return self.directory / f'{guild_id}.json'
+
+    @classmethod
+    def split(cls, directory, data):
+        # One-off conversion of a whole 'guild-user' keyed store
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        guilds = {}
+        for key, value in (data or {}).items():
+            guild_id, user_id = split_key(key)
+            guilds.setdefault(guild_id, {})[str(user_id)] = value
+        for guild_id, members in guilds.items():
+            with open(directory / f'{guild_id}.json', 'w') as f:
+                json.dump(members, f)
+        return len(guilds)
+
+    def load(self, guild_id):
+        members = self.guilds.get(guild_id)
+        self.last_used[guild_id] = time.monotonic()
+        if members is not None:
+            self.guilds.move_to_end(guild_id)
+            return members
+
+        try:
+            with open(self.path(guild_id), 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        members = self.guilds[guild_id] = {
+            int(user_id): value if self.record is None else self.record.from_dict(value)
+            for user_id, value in data.items()
+        }
+        if self.on_load:
+            self.on_load(guild_id)
+        return members
+
+    def evict(self, idle_after, max_loaded, keep=()):
+        # Drops guilds idle for idle_after seconds, and the least recently
+        # used ones beyond max_loaded. Guilds in keep still have unsaved
+        # changes and stay loaded until the next round.
+        now = time.monotonic()
+        evicted = []
+        for guild_id in list(self.guilds):
+            over = len(self.guilds) > max_loaded
+            if not over and now - self.last_used[guild_id] < idle_after:
+                break
+            if guild_id in keep:
+                continue
+            del self.guilds[guild_id]
+            del self.last_used[guild_id]
+            evicted.append(guild_id)
+            if self.on_evict:
+                self.on_evict(guild_id)
+        return evicted
+
+    # Same interface as members.MemberMap
+
+    def __len__(self):
+        return sum(len(members) for members in self.guilds.values())
+
+    def get(self, guild_id, user_id, default=None):
+        return self.load(guild_id).get(user_id, default)
+
+    def set(self, guild_id, user_id, value):
+        self.load(guild_id)[user_id] = value
+
+    def pop(self, guild_id, user_id, default=None):
+        return self.load(guild_id).pop(user_id, default)
+
+    def guild_ids(self):
+        # Only the loaded guilds
+        return list(self.guilds)
+
+    def count(self, guild_id):
+        return len(self.load(guild_id))
+
+    def items(self):
+        for guild_id, members in self.guilds.items():
+            for user_id, value in members.items():
+                yield guild_id, user_id, value
+
+    def pairs(self, guild_id, name):
+        return ((user_id, getattr(value, name)) for user_id, value in self.load(guild_id).items())
+
+    def total(self, guild_id, name):
+        return sum(value for _, value in self.pairs(guild_id, name))
+
+    def top(self, guild_id, name, count):
+        return heapq.nlargest(count, self.pairs(guild_id, name), key=lambda pair: pair[1])
+
+    def reset(self, guild_id, name, value):
+        for record in self.load(guild_id).values():
+            setattr(record, name, value)
+
+    def to_value(self, value):
+        return copy_json(value) if self.record is None else value.to_dict()
+
+    # Persistence, called like a storage backend
+
+    def prepare(self, name, data, keys):
+        if keys is None:
+            guild_ids = list(self.guilds)
+        else:
+            guild_ids = {split_key(key)[0] for key in keys}
+        return {
+            guild_id: {str(user_id): self.to_value(value) for user_id, value in self.guilds[guild_id].items()}
+            for guild_id in guild_ids if guild_id in self.guilds
+        }
+
+    def write(self, name, payload):
+        for guild_id, members in payload.items():
+            path = self.path(guild_id)
+            if not members:
+                if path.exists():
+                    path.unlink()
+                continue
+            tmp_path = path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(members))
+            os.replace(tmp_path, path)
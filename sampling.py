@@ -0,0 +1,56 @@
+# Weighted random sampling for giveaway draws. AliasSampler (Walker's alias
+# method) takes O(n) to build and O(1) per draw; weighted_sample() draws
+# without replacement by rejecting repeats, and rebuilds the table without
+# the chosen items if repeats start to dominate (one entrant holding most
+# of the weight).
+
+import random
+
+
+class AliasSampler:
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        if n == 0 or total <= 0:
+            raise ValueError('weights must contain a positive value')
+
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # Whatever is left is 1 up to rounding error
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def draw(self, rng=random):
+        i = rng.randrange(len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+def weighted_sample(items, weights, count, exclude=(), rng=random):
+    # Draws up to count distinct items, each draw proportional to weight
+    # among the items not yet drawn. Items in exclude and items with no
+    # weight are never drawn.
+    pool = [(item, w) for item, w in zip(items, weights) if w > 0 and item not in exclude]
+    chosen = []
+    picked = set()
+    while pool and len(chosen) < count:
+        sampler = AliasSampler([w for _, w in pool])
+        misses = 0
+        while len(chosen) < count and misses < 2 * count + 16:
+            item = pool[sampler.draw(rng)][0]
+            if item in picked:
+                misses += 1
+                continue
+            picked.add(item)
+            chosen.append(item)
+        pool = [(item, w) for item, w in pool if item not in picked]
+    return chosen
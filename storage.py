@@ -0,0 +1,431 @@
+# Storage backends for the bot's data stores.
+#
+# bot.py keeps every store in memory as a dict and tells the backend which
+# keys changed. prepare() runs on the event loop and must be cheap; write()
+# runs in a worker thread.
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+from members import copy_json, split_key
+
+STORE_NAMES = [
+    'config', 'levels', 'mutes', 'warns', 'gambling', 'afk',
+    'protections', 'command_penalties', 'level_blacklist', 'giveaways'
+]
+
+
+def store_value(data, key):
+    # Stores kept in another shape in memory (see members.MemberMap) hand
+    # over plain JSON values themselves
+    if isinstance(data, dict):
+        return data.get(key)
+    return data.store_value(key)
+
+
+def snapshot(data):
+    # A copy that the worker thread can encode while the event loop keeps
+    # changing the store
+    return copy_json(data) if isinstance(data, dict) else data.to_store()
+
+
+class XPJournal:
+    # Append-only log of 'guild-user xp' lines for the levels store. Each
+    # line carries the resulting XP rather than a delta, so replaying a
+    # line twice is harmless.
+    def __init__(self, path):
+        self.path = Path(path)
+        self.rotated_path = self.path.with_suffix('.journal.compacting')
+        self.file = None
+        self.size = self.path.stat().st_size if self.path.exists() else 0
+
+    def replay(self, data):
+        # The rotated file is older than the active one, so it goes first
+        count = 0
+        for path in (self.rotated_path, self.path):
+            if not path.exists():
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    # A line cut short by a crash has no newline; skip it
+                    if not line.endswith('\n') or len(parts) != 2:
+                        continue
+                    key, xp = parts
+                    if xp == '-':
+                        data.pop(key, None)
+                    elif key in data:
+                        data[key]['xp'] = int(xp)
+                    else:
+                        data[key] = {'xp': int(xp)}
+                    count += 1
+        return count
+
+    def append(self, records):
+        if self.file is None:
+            self.file = open(self.path, 'a+b')
+            self.file.seek(0, os.SEEK_END)
+            if self.file.tell() > 0:
+                self.file.seek(-1, os.SEEK_END)
+                if self.file.read(1) != b'\n':
+                    self.file.write(b'\n')
+            self.size = self.file.tell()
+
+        payload = ''.join(f'{key} {"-" if xp is None else xp}\n' for key, xp in records).encode()
+        self.file.write(payload)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size += len(payload)
+
+    def rotate(self):
+        # Start a fresh journal before the snapshot is taken, so nothing
+        # appended during compaction is lost when the old one is removed
+        self.close()
+        if self.path.exists():
+            os.replace(self.path, self.rotated_path)
+        self.size = 0
+
+    def finish_compaction(self):
+        if self.rotated_path.exists():
+            os.remove(self.rotated_path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class JSONBackend:
+    # One JSON file per store, rewritten whole whenever the store is dirty.
+    # With journal=True, XP changes are appended to levels.journal instead
+    # and folded back into levels.json once it grows past compact_bytes.
+    def __init__(self, data_dir, journal=False, compact_bytes=4 * 1024 * 1024):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(exist_ok=True)
+        self.journal = XPJournal(self.data_dir / 'levels.journal') if journal else None
+        self.compact_bytes = compact_bytes
+
+    def path(self, name):
+        return self.data_dir / f'{name}.json'
+
+    def load(self, name, compact=True):
+        # compact=False replays the journal without touching the files, for
+        # tools that only read the data directory
+        path = self.path(name)
+        data = None
+        if path.exists():
+            with open(path, 'r') as f:
+                data = json.load(f)
+
+        if name == 'levels' and self.journal is not None:
+            if data is None:
+                data = {}
+            replayed = self.journal.replay(data)
+            if replayed:
+                print(f'Replayed {replayed} XP journal records')
+                if compact:
+                    self.compact(data)
+            data = data or None
+        return data
+
+    def prepare(self, name, data, keys):
+        if name == 'levels' and self.journal is not None and keys is not None:
+            records = []
+            for key in keys:
+                value = store_value(data, key)
+                records.append((key, None if value is None else value['xp']))
+            # Only hand over a full copy when the journal is due for compaction
+            full = snapshot(data) if self.journal.size >= self.compact_bytes else None
+            return 'journal', records, full
+        return 'full', snapshot(data)
+
+    def write(self, name, payload):
+        if payload[0] == 'journal':
+            _, records, data = payload
+            self.journal.append(records)
+            if data is not None:
+                self.compact(data)
+            return
+
+        data = payload[1]
+        if name == 'levels' and self.journal is not None:
+            self.compact(data)
+        else:
+            self.write_file(name, data)
+
+    def write_file(self, name, data):
+        payload = json.dumps(data)
+        path = self.path(name)
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def compact(self, data):
+        self.journal.rotate()
+        self.write_file('levels', data)
+        self.journal.finish_compaction()
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+
+def join_key(guild_id, user_id):
+    return f'{guild_id}-{user_id}'
+
+
+class MemberTable:
+    # A store keyed by 'guild-user' with one row per member.
+    def __init__(self, name, columns, to_row, from_row):
+        self.name = name
+        self.columns = columns
+        self.to_row = to_row
+        self.from_row = from_row
+
+    def create(self, db):
+        cols = ', '.join(f'{c} {t}' for c, t in self.columns)
+        db.execute(f'CREATE TABLE IF NOT EXISTS {self.name} (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, {cols}, PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID')
+
+    def rows(self, key, value):
+        guild_id, user_id = split_key(key)
+        return [(guild_id, user_id) + self.to_row(value)]
+
+    def delete(self, db, key):
+        db.execute(f'DELETE FROM {self.name} WHERE guild_id = ? AND user_id = ?', split_key(key))
+
+    def insert(self, db, rows):
+        placeholders = ', '.join('?' * (len(self.columns) + 2))
+        db.executemany(f'INSERT OR REPLACE INTO {self.name} VALUES ({placeholders})', rows)
+
+    def load(self, db):
+        data = {}
+        for row in db.execute(f'SELECT * FROM {self.name}'):
+            data[join_key(row[0], row[1])] = self.from_row(row[2:])
+        return data
+
+
+class WarnsTable:
+    # warns maps 'guild-user' to a list, stored as one row per warning.
+    name = 'warns'
+
+    def create(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS warns (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, warn_id INTEGER NOT NULL, reason TEXT, moderator TEXT, timestamp TEXT, PRIMARY KEY (guild_id, user_id, warn_id)) WITHOUT ROWID')
+        db.execute('CREATE INDEX IF NOT EXISTS warns_by_time ON warns (guild_id, user_id, timestamp)')
+
+    def rows(self, key, value):
+        guild_id, user_id = split_key(key)
+        return [(guild_id, user_id, w['id'], w['reason'], w['moderator'], w['timestamp']) for w in value]
+
+    def delete(self, db, key):
+        db.execute('DELETE FROM warns WHERE guild_id = ? AND user_id = ?', split_key(key))
+
+    def insert(self, db, rows):
+        db.executemany('INSERT OR REPLACE INTO warns VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def load(self, db):
+        data = {}
+        for guild_id, user_id, warn_id, reason, moderator, timestamp in db.execute('SELECT * FROM warns ORDER BY guild_id, user_id, warn_id'):
+            data.setdefault(join_key(guild_id, user_id), []).append({
+                'id': warn_id,
+                'reason': reason,
+                'moderator': moderator,
+                'timestamp': timestamp
+            })
+        return data
+
+
+class KeyValueTable:
+    # Stores whose records have no fixed shape keep a JSON blob per key.
+    # extra columns are pulled out of the record so they can be indexed.
+    def __init__(self, name, key_type='TEXT', extra=(), indexes=()):
+        self.name = name
+        self.key_type = key_type
+        self.extra = extra
+        self.indexes = indexes
+
+    def create(self, db):
+        cols = ''.join(f', {c} {t}' for c, t, _ in self.extra)
+        db.execute(f'CREATE TABLE IF NOT EXISTS {self.name} (key {self.key_type} PRIMARY KEY, data TEXT NOT NULL{cols})')
+        for i, columns in enumerate(self.indexes):
+            db.execute(f'CREATE INDEX IF NOT EXISTS {self.name}_idx{i} ON {self.name} ({columns})')
+
+    def rows(self, key, value):
+        key = int(key) if self.key_type == 'INTEGER' else key
+        return [(key, json.dumps(value)) + tuple(get(value) for _, _, get in self.extra)]
+
+    def delete(self, db, key):
+        key = int(key) if self.key_type == 'INTEGER' else key
+        db.execute(f'DELETE FROM {self.name} WHERE key = ?', (key,))
+
+    def insert(self, db, rows):
+        placeholders = ', '.join('?' * (len(self.extra) + 2))
+        db.executemany(f'INSERT OR REPLACE INTO {self.name} VALUES ({placeholders})', rows)
+
+    def load(self, db):
+        return {str(key): json.loads(data) for key, data in db.execute(f'SELECT key, data FROM {self.name}')}
+
+
+class LevelBlacklistTable:
+    name = 'level_blacklist'
+
+    def create(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS level_blacklist (guild_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, PRIMARY KEY (guild_id, channel_id)) WITHOUT ROWID')
+
+    def rows(self, key, value):
+        return [(int(key), int(channel_id)) for channel_id in value]
+
+    def delete(self, db, key):
+        db.execute('DELETE FROM level_blacklist WHERE guild_id = ?', (int(key),))
+
+    def insert(self, db, rows):
+        db.executemany('INSERT OR REPLACE INTO level_blacklist VALUES (?, ?)', rows)
+
+    def load(self, db):
+        data = {}
+        for guild_id, channel_id in db.execute('SELECT guild_id, channel_id FROM level_blacklist'):
+            data.setdefault(str(guild_id), []).append(str(channel_id))
+        return data
+
+
+SQLITE_TABLES = {
+    'config': KeyValueTable('config'),
+    'levels': MemberTable(
+        'levels',
+        # last_message is no longer written but stays in the schema so
+        # existing databases keep working
+        [('xp', 'INTEGER NOT NULL'), ('last_message', 'REAL')],
+        lambda v: (v['xp'], None),
+        lambda row: {'xp': row[0]}
+    ),
+    'mutes': MemberTable(
+        'mutes',
+        [('end_time', 'REAL NOT NULL'), ('reason', 'TEXT')],
+        lambda v: (v['end_time'], v.get('reason')),
+        lambda row: {'end_time': row[0], 'reason': row[1]}
+    ),
+    'warns': WarnsTable(),
+    'gambling': MemberTable(
+        'gambling',
+        [('coins', 'INTEGER NOT NULL'), ('last_daily', 'REAL'), ('items', 'TEXT')],
+        lambda v: (v['coins'], v.get('last_daily', 0), json.dumps(v.get('items', []))),
+        lambda row: {'coins': row[0], 'last_daily': row[1], 'items': json.loads(row[2])}
+    ),
+    'afk': MemberTable(
+        'afk',
+        [('reason', 'TEXT'), ('timestamp', 'REAL')],
+        lambda v: (v['reason'], v['timestamp']),
+        lambda row: {'reason': row[0], 'timestamp': row[1]}
+    ),
+    'protections': MemberTable(
+        'protections',
+        [('infinite', 'INTEGER NOT NULL'), ('end_time', 'REAL'), ('timestamp', 'TEXT')],
+        lambda v: (int(v.get('infinite', False)), v.get('end_time'), v.get('timestamp')),
+        lambda row: {'infinite': True, 'timestamp': row[2]} if row[0] else {'end_time': row[1], 'infinite': False, 'timestamp': row[2]}
+    ),
+    'command_penalties': KeyValueTable(
+        'command_penalties',
+        extra=[('end_time', 'REAL', lambda v: v.get('end_time'))],
+        indexes=['end_time']
+    ),
+    'level_blacklist': LevelBlacklistTable(),
+    'giveaways': KeyValueTable(
+        'giveaways',
+        key_type='INTEGER',
+        extra=[
+            ('guild_id', 'INTEGER', lambda v: int(v['guild_id'])),
+            ('end_time', 'REAL', lambda v: v['end_time']),
+            ('ended', 'INTEGER', lambda v: int(v.get('ended', False)))
+        ],
+        indexes=['guild_id', 'ended, end_time']
+    )
+}
+
+
+class SQLiteBackend:
+    # Real tables with one row per record, so a dirty key costs a single
+    # upsert instead of rewriting the store.
+    def __init__(self, path):
+        self.path = Path(path)
+        self.is_new = not self.path.exists()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.lock:
+            for table in SQLITE_TABLES.values():
+                table.create(self.db)
+            self.db.execute('CREATE INDEX IF NOT EXISTS levels_by_xp ON levels (guild_id, xp DESC)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS mutes_by_end ON mutes (end_time)')
+
+    def load(self, name):
+        with self.lock:
+            data = SQLITE_TABLES[name].load(self.db)
+        return data or None
+
+    def prepare(self, name, data, keys):
+        # Rows are built here, on the event loop, so the worker thread never
+        # touches the live dicts.
+        table = SQLITE_TABLES[name]
+        if keys is None:
+            data = snapshot(data)
+            keys = list(data)
+            replace_all = True
+        else:
+            replace_all = False
+
+        changes = []
+        for key in keys:
+            value = store_value(data, key)
+            changes.append((key, None if value is None else table.rows(key, value)))
+        return replace_all, changes
+
+    def write(self, name, payload):
+        replace_all, changes = payload
+        table = SQLITE_TABLES[name]
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                if replace_all:
+                    self.db.execute(f'DELETE FROM {table.name}')
+                for key, rows in changes:
+                    if not replace_all:
+                        table.delete(self.db, key)
+                    if rows:
+                        table.insert(self.db, rows)
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def migrate_json_to_sqlite(data_dir, db_path):
+    source = JSONBackend(data_dir, journal=True)
+    target = SQLiteBackend(db_path)
+    try:
+        for name in STORE_NAMES:
+            data = source.load(name, compact=False)
+            if data is None:
+                continue
+            target.write(name, target.prepare(name, data, None))
+            print(f'Migrated {name}: {len(data)} records')
+    finally:
+        target.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('Usage: python storage.py migrate [data_dir] [db_path]')
+        sys.exit(1)
+
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else 'data'
+    db_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(data_dir, 'bot.db')
+    migrate_json_to_sqlite(data_dir, db_path)